@@ -45,6 +45,14 @@ class LBFGS(custom_import('optimize', 'base')):
         if 'LBFGSTHRESH' not in PAR:
             setattr(PAR, 'LBFGSTHRESH', 0.)
 
+        # LBFGS out-of-core mode
+        if 'LBFGSOUTOFCORE' not in PAR:
+            setattr(PAR, 'LBFGSOUTOFCORE', False)
+
+        # LBFGS number of vector entries processed at once
+        if 'LBFGSCHUNK' not in PAR:
+            setattr(PAR, 'LBFGSCHUNK', 2**18)
+
         super(LBFGS, self).check()
 
     def setup(self):
@@ -52,13 +60,16 @@ class LBFGS(custom_import('optimize', 'base')):
 
         self.LBFGS = getattr(optimize, 'LBFGS')(
             path=PATH.OPTIMIZE,
+            load=self.load,
+            save=self.save,
             memory=PAR.LBFGSMEM,
             maxiter=PAR.LBFGSMAX,
             thresh=PAR.LBFGSTHRESH,
-            precond=self.precond)
+            precond=self.precond,
+            blocksize=PAR.LBFGSCHUNK,
+            outofcore=PAR.LBFGSOUTOFCORE)
 
     def compute_direction(self):
-        g_new = self.load('g_new')
         p_new, self.restarted = self.LBFGS()
         self.save('p_new', p_new)
 
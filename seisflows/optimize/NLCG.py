@@ -49,12 +49,13 @@ class NLCG(custom_import('optimize', 'base')):
 
         self.NLCG = getattr(optimize, 'NLCG')(
             path=PATH.OPTIMIZE,
+            load=self.load,
+            save=self.save,
             maxiter=PAR.NLCGMAX,
             thresh=PAR.NLCGTHRESH,
             precond=self.precond)
 
     def compute_direction(self):
-        g_new = self.load('g_new')
         p_new, self.restarted = self.NLCG()
         self.save('p_new', p_new)
 
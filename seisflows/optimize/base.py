@@ -16,7 +16,7 @@ import numpy as np
 from seisflows.config import ParameterError
 from seisflows.plugins import line_search, preconds
 from seisflows.tools import msg, unix
-from seisflows.tools.array import loadnpy, savenpy
+from seisflows.tools.array import loadnpy, savenpy, VectorStore
 from seisflows.tools.math import angle
 from seisflows.tools.seismic import Writer
 
@@ -41,6 +41,11 @@ class base(object):
      direction is written to 'p_new'. As the inversion progresses, other
      information is stored as well.
 
+     If OPTIMIZE_STORE is set, vectors are instead kept together in a single
+     memory mapped file, so that rotating 'new' vectors into 'old' ones
+     between iterations changes only a small index rather than the files
+     themselves.
+
      Variables
         m_new - current model
         m_old - previous model
@@ -85,6 +90,10 @@ class base(object):
         if 'STEPLENMAX' not in PAR:
             setattr(PAR, 'STEPLENMAX', 0.5)
 
+        # keep vectors in a single memory mapped file?
+        if 'OPTIMIZE_STORE' not in PAR:
+            setattr(PAR, 'OPTIMIZE_STORE', False)
+
         # where temporary files are written
         if 'OPTIMIZE' not in PATH:
             setattr(PATH, 'OPTIMIZE', PATH.SCRATCH+'/'+'optimize')
@@ -140,6 +149,11 @@ class base(object):
 
         # prepare scratch directory
         unix.mkdir(PATH.OPTIMIZE)
+        if PAR.OPTIMIZE_STORE:
+            self.store = VectorStore(PATH.OPTIMIZE+'/'+'vectors')
+        else:
+            self.store = None
+
         if 'MODEL_INIT' in PATH:
             solver = sys.modules['seisflows_solver']
             self.save('m_new', solver.merge(solver.load(PATH.MODEL_INIT)))
@@ -211,7 +225,6 @@ class base(object):
         """ Prepares algorithm machinery and scratch directory for next
           model upate
         """
-        m = self.load('m_new')
         g = self.load('g_new')
         p = self.load('p_new')
         x = self.line_search.search_history()[0]
@@ -220,17 +233,17 @@ class base(object):
         # clean scratch directory
         unix.cd(PATH.OPTIMIZE)
         if self.iter > 1:
-            unix.rm('m_old')
+            self.remove('m_old')
             unix.rm('f_old')
-            unix.rm('g_old')
-            unix.rm('p_old')
-            unix.rm('s_old')
-        unix.mv('m_new', 'm_old')
+            self.remove('g_old')
+            self.remove('p_old')
+            self.remove('s_old')
+        self.rename('m_new', 'm_old')
         unix.mv('f_new', 'f_old')
-        unix.mv('g_new', 'g_old')
-        unix.mv('p_new', 'p_old')
+        self.rename('g_new', 'g_old')
+        self.rename('p_new', 'p_old')
 
-        unix.mv('m_try', 'm_new')
+        self.rename('m_try', 'm_new')
         self.savetxt('f_new', f.min())
 
         # output latest statistics
@@ -287,13 +300,32 @@ class base(object):
             np.squeeze(x),
             np.squeeze(y))
 
-    def load(self, filename):
+    def load(self, filename, mmap=False):
         # reads vectors from disk
-        return loadnpy(PATH.OPTIMIZE+'/'+filename)
+        if self.store:
+            return self.store.load(filename, mmap)
+        return loadnpy(PATH.OPTIMIZE+'/'+filename, mmap)
 
     def save(self, filename, array):
         # writes vectors to disk
-        savenpy(PATH.OPTIMIZE+'/'+filename, array)
+        if self.store:
+            self.store.save(filename, array)
+        else:
+            savenpy(PATH.OPTIMIZE+'/'+filename, array)
+
+    def rename(self, src, dst):
+        # renames vectors on disk
+        if self.store:
+            self.store.rename(src, dst)
+        else:
+            unix.mv(PATH.OPTIMIZE+'/'+src, PATH.OPTIMIZE+'/'+dst)
+
+    def remove(self, filename):
+        # deletes vectors from disk
+        if self.store:
+            self.store.remove(filename)
+        else:
+            unix.rm(PATH.OPTIMIZE+'/'+filename)
 
     def loadtxt(self, filename):
         # reads scalars from disk
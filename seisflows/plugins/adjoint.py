@@ -4,6 +4,10 @@
 # See LICENCE file
 #
 # Functions used by the PREPROCESS class and specified by the MISFIT parameter
+#
+# Functions accept either single traces or record sections of shape (nr, nt),
+# in which case time is the last axis. Functions based on the analytic signal
+# accept precomputed analytic signals asyn and aobs (see misfit.analytic)
 ###############################################################################
 
 # Import Numpy and utilities from Scipy
@@ -24,7 +28,7 @@ def Waveform(syn, obs, nt, dt):
     return wadj
 
 
-def Envelope(syn, obs, nt, dt, eps=0.05):
+def Envelope(syn, obs, nt, dt, eps=0.05, asyn=None, aobs=None):
     """ Envelope difference (Yuan et al 2015, eq 16)
     """
     #Bug fix by Yiyu Ni
@@ -33,54 +37,77 @@ def Envelope(syn, obs, nt, dt, eps=0.05):
     #If offset mute is used, this code would possibly return NaN.
     #Solve:
 
+    if _np.ndim(syn) > 1:
+        # muted traces are skipped row by row
+        keep = _np.sum(syn, axis=-1) != 0.
+        wadj = _np.zeros(syn.shape)
+        if keep.any():
+            asyn, aobs = misfit.analytic(syn[keep], obs[keep],
+                None if asyn is None else asyn[keep],
+                None if aobs is None else aobs[keep])
+            wadj[keep] = _envelope(syn[keep], obs[keep], eps, asyn, aobs)
+        return wadj
+
     if sum(syn) == 0.:
         return _np.zeros(nt)
     else:
-        esyn = abs(_analytic(syn))
-        eobs = abs(_analytic(obs))
-        etmp = (esyn - eobs)/(esyn + eps*esyn.max())
-        wadj = etmp*syn - _np.imag(_analytic(etmp*_np.imag(_analytic(syn))))
-        return wadj
+        asyn, aobs = misfit.analytic(syn, obs, asyn, aobs)
+        return _envelope(syn, obs, eps, asyn, aobs)
+
 
+def _envelope(syn, obs, eps, asyn, aobs):
+    esyn = abs(asyn)
+    eobs = abs(aobs)
+    emax = _np.max(esyn, axis=-1, keepdims=True)
+    etmp = (esyn - eobs)/(esyn + eps*emax)
+    wadj = etmp*syn - _np.imag(_analytic(etmp*_np.imag(asyn)))
+    return wadj
 
-def InstantaneousPhase(syn, obs, nt, dt, eps=0.05):
+
+def InstantaneousPhase(syn, obs, nt, dt, eps=0.05, asyn=None, aobs=None):
     """ Instantaneous phase (from Bozdag et al. 2011, eq 27)
     """
-    r = _np.real(_analytic(syn))
-    i = _np.imag(_analytic(syn))
+    asyn, aobs = misfit.analytic(syn, obs, asyn, aobs)
+
+    r = _np.real(asyn)
+    i = _np.imag(asyn)
     phi_syn = _np.arctan2(i, r)
 
-    r = _np.real(_analytic(obs))
-    i = _np.imag(_analytic(obs))
+    r = _np.real(aobs)
+    i = _np.imag(aobs)
     phi_obs = _np.arctan2(i, r)
 
     phi_rsd = phi_syn - phi_obs
-    esyn = abs(_analytic(syn))
-    emax = max(esyn**2.)
+    esyn = abs(asyn)
+    emax = _np.max(esyn**2., axis=-1, keepdims=True)
 
-    wadj = phi_rsd*_np.imag(_analytic(syn))/(esyn**2. + eps*emax) + \
+    wadj = phi_rsd*_np.imag(asyn)/(esyn**2. + eps*emax) + \
         _np.imag(_analytic(phi_rsd * syn/(esyn**2. + eps*emax)))
 
     return wadj
 
 
-def Traveltime(syn, obs, nt, dt):
+def Traveltime(syn, obs, nt, dt, tau=None):
     """ Cross correlation traveltime (Tromp et al 2005, eq 45)
     """
-    wadj = _np.zeros(nt)
-    wadj[1:-1] = (syn[2:] - syn[0:-2])/(2.*dt)
-    wadj *= 1./(sum(wadj*wadj)*dt)
-    wadj *= misfit.Traveltime(syn, obs, nt, dt)
+    wadj = _np.zeros(_np.shape(syn))
+    wadj[..., 1:-1] = (syn[..., 2:] - syn[..., 0:-2])/(2.*dt)
+    wadj *= 1./(_np.sum(wadj*wadj, axis=-1, keepdims=True)*dt)
+    if tau is None:
+        tau = misfit.Traveltime(syn, obs, nt, dt)
+    wadj *= _column(tau)
     return wadj
 
 
-def TraveltimeInexact(syn, obs, nt, dt):
+def TraveltimeInexact(syn, obs, nt, dt, tau=None):
     """ Much faster (but possibly inaccurate) version of Traveltime function
     """
-    wadj = _np.zeros(nt)
-    wadj[1:-1] = (syn[2:] - syn[0:-2])/(2.*dt)
-    wadj *= 1./(sum(wadj*wadj)*dt)
-    wadj *= misfit.TraveltimeInexact(syn, obs, nt, dt)
+    wadj = _np.zeros(_np.shape(syn))
+    wadj[..., 1:-1] = (syn[..., 2:] - syn[..., 0:-2])/(2.*dt)
+    wadj *= 1./(_np.sum(wadj*wadj, axis=-1, keepdims=True)*dt)
+    if tau is None:
+        tau = misfit.TraveltimeInexact(syn, obs, nt, dt)
+    wadj *= _column(tau)
     return wadj
 
 
@@ -98,39 +125,50 @@ def Envelope2(syn, obs, nt, dt, eps=0.):
     raise NotImplementedError
 
 
-def Envelope3(syn, obs, nt, dt, eps=0.):
+def Envelope3(syn, obs, nt, dt, eps=0., tau=None, asyn=None, aobs=None):
     """ Envelope cross-correlation lag (Yuan et al 2015, eqs B-2, B-5)
     """
-    esyn = abs(_analytic(syn))
-    eobs = abs(_analytic(obs))
+    asyn, aobs = misfit.analytic(syn, obs, asyn, aobs)
+    esyn = abs(asyn)
 
-    erat = _np.zeros(nt)
-    erat[1:-1] = (esyn[2:] - esyn[0:-2])/(2.*dt)
-    erat[1:-1] /= esyn[1:-1]
-    erat *= misfit.Envelope3(syn, obs, nt, dt)
+    erat = _np.zeros(_np.shape(syn))
+    erat[..., 1:-1] = (esyn[..., 2:] - esyn[..., 0:-2])/(2.*dt)
+    erat[..., 1:-1] /= esyn[..., 1:-1]
+    if tau is None:
+        tau = misfit.Envelope3(syn, obs, nt, dt, asyn=asyn, aobs=aobs)
+    erat *= _column(tau)
 
     wadj = -erat*syn + _hilbert(erat*_hilbert(esyn))
     return wadj
 
 
-def InstantaneousPhase2(syn, obs, nt, dt, eps=0.):
-    esyn = abs(_analytic(syn))
-    eobs = abs(_analytic(obs))
+def InstantaneousPhase2(syn, obs, nt, dt, eps=0., asyn=None, aobs=None):
+    asyn, aobs = misfit.analytic(syn, obs, asyn, aobs)
+    hsyn = _np.imag(asyn)
+    hobs = _np.imag(aobs)
+
+    esyn = abs(asyn)
+    eobs = abs(aobs)
 
-    esyn1 = esyn + eps*max(esyn)
-    eobs1 = eobs + eps*max(eobs)
-    esyn3 = esyn**3 + eps*max(esyn**3)
+    esyn1 = esyn + eps*_np.max(esyn, axis=-1, keepdims=True)
+    eobs1 = eobs + eps*_np.max(eobs, axis=-1, keepdims=True)
+    esyn3 = esyn**3 + eps*_np.max(esyn**3, axis=-1, keepdims=True)
 
     diff1 = syn/(esyn1) - obs/(eobs1)
-    diff2 = _hilbert(syn)/esyn1 - _hilbert(obs)/eobs1
+    diff2 = hsyn/esyn1 - hobs/eobs1
 
-    part1 = diff1*_hilbert(syn)**2/esyn3 - diff2*syn*_hilbert(syn)/esyn3
-    part2 = diff1*syn*_hilbert(syn)/esyn3 - diff2*syn**2/esyn3
+    part1 = diff1*hsyn**2/esyn3 - diff2*syn*hsyn/esyn3
+    part2 = diff1*syn*hsyn/esyn3 - diff2*syn**2/esyn3
 
     wadj = part1 + _hilbert(part2)
     return wadj
 
 
+def _column(v):
+    # broadcasts one value per trace along time axis
+    return _np.reshape(v, _np.shape(v) + (1,))
+
+
 # Migration
 
 def Displacement(syn, obs, nt, dt):
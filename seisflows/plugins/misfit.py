@@ -4,57 +4,67 @@
 # See LICENCE file
 #
 # Functions used by the PREPROCESS class and specified by the MISFIT parameter
+#
+# Functions accept either single traces or record sections of shape (nr, nt),
+# in which case time is the last axis and one value per trace is returned.
+# Functions based on the analytic signal accept precomputed analytic signals
+# asyn and aobs, so that they can be shared with adjoint trace generators
 ###############################################################################
 
 # Import Numpy and utilities from Scipy
 import numpy as np
 from scipy.signal import hilbert as _analytic
 
+# Local imports
+from seisflows.tools.signal import correlation_lag
+
 
 def Waveform(syn, obs, nt, dt):
     """ Waveform difference
     """
     wrsd = syn-obs
-    return np.sqrt(np.sum(wrsd*wrsd*dt))
+    return np.sqrt(np.sum(wrsd*wrsd*dt, axis=-1))
 
 
-def Envelope(syn, obs, nt, dt, eps=0.05):
+def Envelope(syn, obs, nt, dt, eps=0.05, asyn=None, aobs=None):
     """ Envelope difference (Yuan et al 2015, eq 9)
     """
-    esyn = abs(_analytic(syn))
-    eobs = abs(_analytic(obs))
+    asyn, aobs = analytic(syn, obs, asyn, aobs)
+    esyn = abs(asyn)
+    eobs = abs(aobs)
     ersd = esyn-eobs
-    return np.sqrt(np.sum(ersd*ersd*dt))
+    return np.sqrt(np.sum(ersd*ersd*dt, axis=-1))
 
 
-def InstantaneousPhase(syn, obs, nt, dt, eps=0.05):
+def InstantaneousPhase(syn, obs, nt, dt, eps=0.05, asyn=None, aobs=None):
     """ Instantaneous phase from Bozdag et al. 2011
     """
-    r = np.real(_analytic(syn))
-    i = np.imag(_analytic(syn))
+    asyn, aobs = analytic(syn, obs, asyn, aobs)
+
+    r = np.real(asyn)
+    i = np.imag(asyn)
     phi_syn = np.arctan2(i, r)
 
-    r = np.real(_analytic(obs))
-    i = np.imag(_analytic(obs))
+    r = np.real(aobs)
+    i = np.imag(aobs)
     phi_obs = np.arctan2(i, r)
 
     phi_rsd = phi_syn - phi_obs
-    return np.sqrt(np.sum(phi_rsd*phi_rsd*dt))
+    return np.sqrt(np.sum(phi_rsd*phi_rsd*dt, axis=-1))
 
 
 def Traveltime(syn, obs, nt, dt):
     """ Compute cross correlation traveltime between two traces suposing that
         they contain only one arrival
     """
-    cc = abs(np.convolve(obs, np.flipud(syn)))
-    return (np.argmax(cc)-nt+1)*dt
+    return correlation_lag(obs, syn, dt)
 
 
 def TraveltimeInexact(syn, obs, nt, dt):
     """ Much faster (but possibly inaccurate) version of Traveltime function
     """
-    it = np.argmax(syn)
-    jt = np.argmax(obs)
+    it = np.argmax(syn, axis=-1)
+    jt = np.argmax(obs, axis=-1)
     return (jt-it)*dt
 
 
@@ -77,24 +87,37 @@ def Envelope2(syn, obs, nt, dt, eps=0.):
     raise NotImplementedError
 
 
-def Envelope3(syn, obs, nt, dt, eps=0.):
+def Envelope3(syn, obs, nt, dt, eps=0., asyn=None, aobs=None):
     """ Envelope cross-correlation lag (Yuan et al 2015, eqs B-4)
     """
-    esyn = abs(_analytic(syn))
-    eobs = abs(_analytic(obs))
+    asyn, aobs = analytic(syn, obs, asyn, aobs)
+    esyn = abs(asyn)
+    eobs = abs(aobs)
     return Traveltime(esyn, eobs, nt, dt)
 
 
-def InstantaneousPhase2(syn, obs, nt, dt, eps=0.):
-    esyn = abs(_analytic(syn))
-    eobs = abs(_analytic(obs))
+def InstantaneousPhase2(syn, obs, nt, dt, eps=0., asyn=None, aobs=None):
+    asyn, aobs = analytic(syn, obs, asyn, aobs)
+    esyn = abs(asyn)
+    eobs = abs(aobs)
 
-    esyn1 = esyn + eps*max(esyn)
-    eobs1 = eobs + eps*max(eobs)
+    esyn1 = esyn + eps*np.max(esyn, axis=-1, keepdims=True)
+    eobs1 = eobs + eps*np.max(eobs, axis=-1, keepdims=True)
 
     diff = syn/esyn1 - obs/eobs1
 
-    return np.sqrt(np.sum(diff*diff*dt))
+    return np.sqrt(np.sum(diff*diff*dt, axis=-1))
+
+
+def analytic(syn, obs, asyn=None, aobs=None):
+    """ Returns analytic signals of synthetics and observations, computing
+      only those not already given
+    """
+    if asyn is None:
+        asyn = _analytic(syn)
+    if aobs is None:
+        aobs = _analytic(obs)
+    return asyn, aobs
 
 
 def Displacement(syn, obs, nt, dt):
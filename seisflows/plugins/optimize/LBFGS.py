@@ -22,11 +22,14 @@ class LBFGS(object):
         conditions.
 
         To conserve memory, most vectors are read from disk rather than
-        passed from a calling routine.
+        passed from a calling routine. In out-of-core mode, input and work
+        vectors are memory mapped as well and processed blocksize entries
+        at a time, so that peak memory does not grow with model size.
     """
 
     def __init__(self, path='.', load=loadnpy, save=savenpy, memory=5,
-                 thresh=0., maxiter=np.inf, precond=None):
+                 thresh=0., maxiter=np.inf, precond=None, blocksize=2**18,
+                 outofcore=False):
         assert exists(path)
         unix.cd(path)
         unix.mkdir('LBFGS')
@@ -38,9 +41,12 @@ class LBFGS(object):
         self.maxiter = maxiter
         self.precond = precond
         self.memory = memory
+        self.blocksize = blocksize
+        self.outofcore = outofcore
 
         self.iter = 0
         self.memory_used = 0
+        self.head = 0
 
     def __call__(self):
         """ Returns L-BFGS search direction
@@ -48,14 +54,14 @@ class LBFGS(object):
         self.iter += 1
 
         unix.cd(self.path)
-        g = self.load('g_new')
+        g = self._load('g_new')
         if self.iter == 1:
-            return -g, 0
+            return self._negative(g), 0
 
         elif self.iter > self.maxiter:
             print('restarting LBFGS... [periodic restart]')
             self.restart()
-            return -g, 1
+            return self._negative(g), 1
 
         S, Y = self.update()
         q = self.apply(g, S, Y)
@@ -63,60 +69,83 @@ class LBFGS(object):
         status = self.check_status(g, q)
         if status != 0:
             self.restart()
-            return -g, status
+            return self._negative(g), status
         else:
-            return -q, status
+            return self._negative(q), status
 
     def update(self):
         """ Updates L-BFGS algorithm history
+
+          History is kept in a ring buffer; rows of S and Y hold s and y
+          vectors, with the most recent pair stored in row self.head.
         """
         unix.cd(self.path)
 
-        s = self.load('m_new') - self.load('m_old')
-        y = self.load('g_new') - self.load('g_old')
+        m_new = self._load('m_new')
+        m_old = self._load('m_old')
+        g_new = self._load('g_new')
+        g_old = self._load('g_old')
 
-        m = len(s)
+        m = len(m_new)
         n = self.memory
 
         if self.memory_used == 0:
-            S = np.memmap('LBFGS/S', mode='w+', dtype='float32', shape=(m, n))
-            Y = np.memmap('LBFGS/Y', mode='w+', dtype='float32', shape=(m, n))
-            S[:, 0] = s
-            Y[:, 0] = y
+            S = np.memmap('LBFGS/S', mode='w+', dtype='float32', shape=(n, m))
+            Y = np.memmap('LBFGS/Y', mode='w+', dtype='float32', shape=(n, m))
+            self.head = 0
             self.memory_used = 1
 
         else:
-            S = np.memmap('LBFGS/S', mode='r+', dtype='float32', shape=(m, n))
-            Y = np.memmap('LBFGS/Y', mode='r+', dtype='float32', shape=(m, n))
-            S[:, 1:] = S[:, :-1]
-            Y[:, 1:] = Y[:, :-1]
-            S[:, 0] = s
-            Y[:, 0] = y
+            S = np.memmap('LBFGS/S', mode='r+', dtype='float32', shape=(n, m))
+            Y = np.memmap('LBFGS/Y', mode='r+', dtype='float32', shape=(n, m))
+            self.head = (self.head + 1) % n
 
             if self.memory_used < self.memory:
                 self.memory_used += 1
 
+        for i, j in self._blocks(m):
+            S[self.head, i:j] = m_new[i:j] - m_old[i:j]
+            Y[self.head, i:j] = g_new[i:j] - g_old[i:j]
+
         return S, Y
 
-    def apply(self, q, S=[], Y=[]):
+    def apply(self, q, S=None, Y=None):
         """ Applies L-BFGS inverse Hessian to given vector
+
+          Inner products required by the two-loop recursion are expressed
+          in terms of small Gram matrices, so that the history is traversed
+          a fixed number of times, in blocks, regardless of memory size.
         """
         unix.cd(self.path)
 
-        if S == [] or Y == []:
+        if S is None or Y is None:
             m = len(q)
             n = self.memory
-            S = np.memmap('LBFGS/S', mode='w+', dtype='float32', shape=(m, n))
-            Y = np.memmap('LBFGS/Y', mode='w+', dtype='float32', shape=(m, n))
+            S = np.memmap('LBFGS/S', mode='r', dtype='float32', shape=(n, m))
+            Y = np.memmap('LBFGS/Y', mode='r', dtype='float32', shape=(n, m))
 
-        # first matrix product
+        # history rows, from most recent to oldest
         kk = self.memory_used
-        rh = np.zeros(kk)
+        rows = [(self.head - ii) % self.memory for ii in range(kk)]
+
+        # Y^T S and S^T q
+        YtS = np.zeros((kk, kk))
+        Stq = np.zeros(kk)
+        yty = 0.
+        for i, j in self._blocks(len(q)):
+            Sb = S[rows, i:j]
+            Yb = Y[rows, i:j]
+            YtS += np.dot(Yb, Sb.T)
+            Stq += np.dot(Sb, q[i:j])
+            yty += np.dot(Yb[0], Yb[0])
+
+        # first matrix product
+        rh = 1./np.diag(YtS)
         al = np.zeros(kk)
         for ii in range(kk):
-            rh[ii] = 1/np.dot(Y[:, ii], S[:, ii])
-            al[ii] = rh[ii]*np.dot(S[:, ii], q)
-            q = q - al[ii]*Y[:, ii]
+            al[ii] = rh[ii]*(Stq[ii] - np.dot(YtS[:ii, ii], al[:ii]))
+
+        q = self._combine(q, -al, Y, rows, 'q')
 
         if self.precond:
             r = self.precond(q)
@@ -124,14 +153,22 @@ class LBFGS(object):
             r = q
 
         # use scaling M3 proposed by Liu and Nocedal 1989
-        sty = np.dot(Y[:, 0], S[:, 0])
-        yty = np.dot(Y[:, 0], Y[:, 0])
-        r *= sty/yty
+        sty = YtS[0, 0]
+        for i, j in self._blocks(len(r)):
+            r[i:j] *= sty/yty
+
+        # Y^T r
+        Ytr = np.zeros(kk)
+        for i, j in self._blocks(len(r)):
+            Ytr += np.dot(Y[rows, i:j], r[i:j])
 
         # second matrix product
+        be = np.zeros(kk)
         for ii in range(kk-1, -1, -1):
-            be = rh[ii]*np.dot(Y[:, ii], r)
-            r = r + S[:, ii]*(al[ii] - be)
+            be[ii] = rh[ii]*(Ytr[ii] +
+                np.dot(YtS[ii, ii+1:], al[ii+1:] - be[ii+1:]))
+
+        r = self._combine(r, al - be, S, rows, 'r')
 
         return r
 
@@ -140,12 +177,38 @@ class LBFGS(object):
         """
         self.iter = 1
         self.memory_used = 0
-
-        unix.cd(self.path)
-        S = np.memmap('LBFGS/S', mode='r+')
-        Y = np.memmap('LBFGS/Y', mode='r+')
-        S[:] = 0.
-        Y[:] = 0.
+        self.head = 0
+
+    def _blocks(self, m):
+        # splits vector indices into contiguous blocks
+        for i in range(0, m, self.blocksize):
+            yield i, min(i+self.blocksize, m)
+
+    def _combine(self, v, c, A, rows, name):
+        # adds linear combination of history vectors to given vector
+        w = self._vector(name, len(v), v.dtype)
+        for i, j in self._blocks(len(v)):
+            w[i:j] = v[i:j] + np.dot(c, A[rows, i:j])
+        return w
+
+    def _negative(self, v):
+        w = self._vector('p', len(v), v.dtype)
+        for i, j in self._blocks(len(v)):
+            w[i:j] = -v[i:j]
+        return w
+
+    def _load(self, name):
+        # in out-of-core mode, vectors are memory mapped rather than read
+        if self.outofcore:
+            return self.load(name, mmap=True)
+        return self.load(name)
+
+    def _vector(self, name, m, dtype):
+        # in out-of-core mode, work vectors are backed by files
+        if self.outofcore:
+            return np.memmap('LBFGS/'+name, mode='w+', dtype=dtype,
+                             shape=(m,))
+        return np.zeros(m, dtype=dtype)
 
     def check_status(self, g, r):
         theta = 180.*np.pi**-1*angle(g, r)
@@ -16,6 +16,9 @@
 import sys
 import os
 
+# Import Numpy
+import numpy as np
+
 try:
     PAR = sys.modules['seisflows_parameters']
 except:
@@ -108,53 +111,11 @@ def readBigSuFile(nameOfFile, nt, format='SU', byteorder='<'):
     from obspy.core.utcdatetime import UTCDateTime
     from obspy.core.util import AttribDict
     from obspy.io.segy.core import LazyTraceHeaderAttribDict
-    from obspy.io.segy.segy import SEGYTraceReadingError
-    from obspy.io.segy.segy import SEGYTraceHeaderTooSmallError
-    from obspy.io.segy.segy import SEGYTraceHeader
-    from obspy.io.segy.header import DATA_SAMPLE_FORMAT_UNPACK_FUNCTIONS
-    from obspy.io.segy.header import DATA_SAMPLE_FORMAT_SAMPLE_SIZE
 
-    file_object = open(nameOfFile, 'r')
     endian = byteorder
-    datas = []
-    headers = []
-    data_encoding = 5
-    # Big loop to read all data traces.
-    while True:
-        # Read and as soon as the trace header is too small abort.
-        try:
-            # Always unpack with IEEE
-            filesize = os.fstat(file_object.fileno())[6]
-            trace_header = file_object.read(240)
-            # Check if it is smaller than 240 byte.
-            if len(trace_header) != 240:
-                msg = 'The trace header needs to be 240 bytes long'
-                raise SEGYTraceHeaderTooSmallError(msg)
-            header = SEGYTraceHeader(trace_header, endian=endian)
-            header.number_of_samples_in_this_trace = nt
-            # The number of samples in the current trace.
-            npts = header.number_of_samples_in_this_trace
-            # Do a sanity check if there is enough data left.
-            pos = file_object.tell()
-            data_left = filesize - pos
-            data_needed = DATA_SAMPLE_FORMAT_SAMPLE_SIZE[data_encoding] * npts
-            if npts < 1 or data_needed > data_left:
-                msg = """
-                      Too little data left in the file to unpack it according
-                      to its trace header. This is most likely either due to a
-                      wrong byte order or a corrupt file.
-                      """.strip()
-                raise SEGYTraceReadingError(msg)
-            else:
-                # Unpack the data
-                dsfuf = DATA_SAMPLE_FORMAT_UNPACK_FUNCTIONS
-                data = dsfuf[data_encoding](file_object, npts, endian=endian)
-            datas.append(data)
-            headers.append(header)
-        except SEGYTraceHeaderTooSmallError:
-            break
-
-    file_object.close()
+    section = SuSection(nameOfFile, nt, byteorder)
+    datas = np.array(section.data, dtype='float32')
+
     # Create the stream object.
     stream = Stream()
 
@@ -168,8 +129,7 @@ def readBigSuFile(nameOfFile, nt, format='SU', byteorder='<'):
         trace.stats.segy = AttribDict()
 
         # Add the trace header as a new lazy attrib dictionary.
-        header = LazyTraceHeaderAttribDict(headers[idx].unpacked_header,
-                                           endian)
+        header = LazyTraceHeaderAttribDict(section.raw_header(idx), endian)
         trace.stats.segy.trace_header = header
         # Also set the endianness.
         trace.stats.segy.endian = endian
@@ -179,7 +139,7 @@ def readBigSuFile(nameOfFile, nt, format='SU', byteorder='<'):
         tr_header = trace.stats.segy.trace_header
         if tr_header.sample_interval_in_ms_for_this_trace > 0:
             trace.stats.delta = \
-                float(headers[idx].sample_interval_in_ms_for_this_trace) / 1E6
+                float(tr_header.sample_interval_in_ms_for_this_trace) / 1E6
         # If the year is not zero, calculate the start time. The end time is
         # then calculated from the start time and the sampling rate.
         # 99 is often used as a placeholder.
@@ -209,3 +169,105 @@ def readBigSuFile(nameOfFile, nt, format='SU', byteorder='<'):
         trace.stats._format = format
 
     return stream
+
+
+def su_dtype(nt, byteorder='<'):
+    """ Returns numpy data type describing one SU trace record
+
+        Fields are 'header' (all 240 header bytes), 'data' (nt samples) and
+        the header entries listed in SuSection.HEADER_FIELDS
+    """
+    names = ['header', 'data']
+    formats = ['V240', (byteorder+'f4', (nt,))]
+    offsets = [0, 240]
+    for key, (offset, fmt) in SuSection.HEADER_FIELDS.items():
+        names += [key]
+        formats += [byteorder+fmt]
+        offsets += [offset]
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': 240+4*nt})
+
+
+class SuSection(object):
+    """ Memory mapped view of Seismic Unix file
+
+        Since each trace in a SPECFEM SU file has the same record size,
+        240 + 4*nt bytes, the file can be mapped as a numpy structured array.
+        Trace data are then available as an (nr, nt) array without any
+        parsing, and only the header fields used by SeisFlows are decoded.
+        An obspy Stream is built only if requested.
+    """
+    # byte offset and format of decoded header fields
+    HEADER_FIELDS = {
+        'scalar_to_be_applied_to_all_coordinates': (70, 'i2'),
+        'source_coordinate_x': (72, 'i4'),
+        'source_coordinate_y': (76, 'i4'),
+        'group_coordinate_x': (80, 'i4'),
+        'group_coordinate_y': (84, 'i4'),
+        'number_of_samples_in_this_trace': (114, 'u2'),
+        'sample_interval_in_ms_for_this_trace': (116, 'u2'),
+        }
+
+    def __init__(self, filename, nt, byteorder='<'):
+        self.filename = filename
+        self.nt = nt
+        self.byteorder = byteorder
+
+        self.dtype = su_dtype(nt, byteorder)
+
+        if os.path.getsize(filename) % self.dtype.itemsize:
+            raise ValueError('Size of %s is inconsistent with %d samples '
+                             'per trace.' % (filename, nt))
+
+        self.records = np.memmap(filename, dtype=self.dtype, mode='r')
+        self._stream = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def data(self):
+        """ Read only (nr, nt) view of trace data
+        """
+        return self.records['data']
+
+    def header(self, key):
+        """ Returns given header field for all traces
+        """
+        return np.array(self.records[key])
+
+    @property
+    def headers(self):
+        """ Copy of header bytes of all traces
+        """
+        return np.array(self.records['header'])
+
+    def raw_header(self, ir):
+        """ Returns header bytes of given trace
+        """
+        return self.records['header'][ir].tostring()
+
+    @property
+    def delta(self):
+        return float(self.records['sample_interval_in_ms_for_this_trace'][0])\
+            / 1E6
+
+    def source_coords(self):
+        sx = self.header('source_coordinate_x')
+        sy = self.header('source_coordinate_y')
+        return sx, sy, np.zeros(len(self))
+
+    def receiver_coords(self):
+        rx = self.header('group_coordinate_x')
+        ry = self.header('group_coordinate_y')
+        return rx, ry, np.zeros(len(self))
+
+    @property
+    def stream(self):
+        """ Obspy Stream holding a copy of the data, created on first access
+        """
+        if self._stream is None:
+            self._stream = readBigSuFile(self.filename, self.nt,
+                                         format='SU',
+                                         byteorder=self.byteorder)
+        return self._stream
@@ -16,15 +16,18 @@ import numpy as np
 from seisflows.tools.tools import iterable
 
 
-def read_slice(path, parameters, iproc):
+def read_slice(path, parameters, iproc, mmap=False):
     """ Reads SPECFEM model slice(s)
         Such as, for example : proc000005_vp.bin
         In that specific case it would be : read_slice(path, 'vp', 5)
+
+        If mmap is True, slices are returned as read-only memory maps, so
+        that data are paged in from disk only when actually accessed
     """
     vals = []
     for key in iterable(parameters):
         filename = '%s/proc%06d_%s.bin' % (path, iproc, key)
-        vals += [_read(filename)]
+        vals += [_read(filename, mmap)]
     return vals
 
 
@@ -43,22 +46,37 @@ def copy_slice(src, dst, iproc, parameter):
     copyfile(join(src, filename), join(dst, filename))
 
 
-def _read(filename):
+def _read(filename, mmap=False):
     """ Reads Fortran style binary data into numpy array
+
+        If mmap is True, returns a read-only memory map starting just past
+        the record header instead of reading the file into memory
     """
     nbytes = getsize(filename)
+    if nbytes < 4:
+        # empty slice, which cannot be mapped
+        return np.zeros(0, dtype='float32')
+
     with open(filename, 'rb') as file:
         # read size of record
         file.seek(0)
         n = np.fromfile(file, dtype='int32', count=1)[0]
-        if n == nbytes-8:
-            file.seek(4)
-            data = np.fromfile(file, dtype='float32')
-            return data[:-1]
-        else:
-            file.seek(0)
-            data = np.fromfile(file, dtype='float32')
-            return data
+
+    if n == nbytes-8:
+        # skip leading and trailing record markers
+        offset = 4
+        count = n//4
+    else:
+        offset = 0
+        count = nbytes//4
+
+    if mmap and count > 0:
+        return np.memmap(filename, dtype='float32', mode='r',
+                         offset=offset, shape=(count,))
+
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        return np.fromfile(file, dtype='float32', count=count)
 
 
 def _write(v, filename):
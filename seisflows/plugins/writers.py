@@ -19,6 +19,9 @@ import sys
 # Import numpy
 import numpy as np
 
+# Local imports
+from seisflows.plugins.readers import su_dtype
+
 try:
     PAR = sys.modules['seisflows_parameters']
 except:
@@ -168,3 +171,34 @@ def writeBigSuFile(stream, path, byteorder='<'):
         DATA_SAMPLE_FORMAT_PACK_FUNCTIONS[data_encoding](file, trace.data,
                                                          endian=endian)
     file.close()
+
+
+def writeSuSection(data, headers, path, byteorder='<'):
+    """ Writes record section to Seismic Unix file in a single write
+
+        Rather than building obspy header objects trace by trace, header
+        bytes are taken from an existing file, usually the matching
+        synthetics (see readers.SuSection.headers), and only the fields
+        writeBigSuFile would change are modified.
+
+        :input data: array of shape (nr, nt)
+        :input headers: array of nr raw 240 byte trace headers
+        :input path: name of file to be written
+    """
+    dummy_npts = 9999
+    max_interval = 65535
+
+    nr, nt = np.shape(data)
+    records = np.zeros(nr, dtype=su_dtype(nt, byteorder))
+    records['header'] = headers
+    records['data'] = data
+
+    records['number_of_samples_in_this_trace'] = dummy_npts
+
+    # obspy assumes a sample interval of one second if none is given,
+    # which writers.su replaces by the largest interval that fits
+    interval = records['sample_interval_in_ms_for_this_trace']
+    interval[interval == 0] = max_interval
+    records['sample_interval_in_ms_for_this_trace'] = interval
+
+    records.tofile(path)
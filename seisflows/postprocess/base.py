@@ -71,19 +71,16 @@ class base(object):
                           path=path+'/kernels',
                           parameters=solver.parameters)
 
-        gradient = solver.load(
-            path+'/'+'kernels/sum', suffix='_kernel')
-
-        # merge into a single vector
-        gradient = solver.merge(gradient)
+        # load kernels, merged into a single vector
+        gradient = solver.load_merged(path+'/'+'kernels/sum', suffix='_kernel')
 
         # convert to absolute perturbations, log dm --> dm
         # see Eq.13 Tromp et al 2005
-        gradient *= solver.merge(solver.load(path + '/' + 'model'))
+        gradient *= solver.load_merged(path + '/' + 'model')
         if PATH.MASK:
             # to scale the gradient, users can supply "masks" by exactly
             # mimicking the file format in which models are stored
-            mask = solver.merge(solver.load(PATH.MASK))
+            mask = solver.load_merged(PATH.MASK)
 
             # while both masking and preconditioning involve scaling the
             # gradient, they are fundamentally different operations:
@@ -6,7 +6,9 @@
 ###############################################################################
 
 # Import system modules
+import os
 import sys
+import tempfile
 
 # Import Numpy and Obspy
 import numpy as np
@@ -14,7 +16,7 @@ import obspy
 
 # Local imports
 from seisflows.tools import msg, unix
-from seisflows.tools.tools import exists, getset
+from seisflows.tools.tools import exists, getset, pmap
 from seisflows.config import ParameterError
 from seisflows.plugins import adjoint, misfit, readers, writers
 from seisflows.tools import signal
@@ -25,6 +27,11 @@ try:
 except:
     print("Check parameters and paths.")
 
+
+# entry of binary record of partial misfits, see append_misfit
+MISFIT_RECORD = np.dtype([('task', '<i4'), ('misfit', '<f8')])
+
+
 class base(object):
     """ Data preprocessing class
 
@@ -58,6 +65,18 @@ class base(object):
         # data filtering option
         if 'FILTER' not in PAR:
             setattr(PAR, 'FILTER', None)
+
+        # process whole record sections as arrays rather than trace by trace
+        if 'VECTORIZE' not in PAR:
+            setattr(PAR, 'VECTORIZE', False)
+
+        # number of workers used to preprocess channels concurrently
+        if 'PREPROCESS_NPROC' not in PAR:
+            setattr(PAR, 'PREPROCESS_NPROC', 1)
+
+        # type of worker pool, either 'thread' or 'process'
+        if 'PREPROCESS_POOL' not in PAR:
+            setattr(PAR, 'PREPROCESS_POOL', 'thread')
         
         # # apply trace downsampling
         # if 'DOWNSAMPLE_FACTOR' not in PAR:
@@ -72,6 +91,11 @@ class base(object):
             print(msg.WriterError)
             raise ParameterError()
 
+        if PAR.VECTORIZE:
+            assert PAR.FORMAT in ['SU', 'su']
+
+        assert PAR.PREPROCESS_POOL in ['thread', 'process']
+
         self.check_filter()
         self.check_mute()
         self.check_normalize()
@@ -93,55 +117,150 @@ class base(object):
     def prepare_eval_grad(self, path='.'):
         """
          Prepares solver for gradient evaluation by writing residuals and
-         adjoint traces
+         adjoint traces. Residuals of all channels are collected in memory
+         and written once.
 
          :input path: directory containing observed and synthetic seismic data
         """
         solver = sys.modules['seisflows_solver']
 
-        for filename in solver.data_filenames:
-            obs = self.reader(path+'/'+'traces/obs', filename)
-            syn = self.reader(path+'/'+'traces/syn', filename)
-
-            # process observations
-            obs = self.apply_filter(obs)
-            obs = self.apply_mute(obs)
-            obs = self.apply_normalize(obs)
+        # workers left over once each channel has its own are used to split
+        # record sections into chunks of receivers
+        nchunks = max(1, PAR.PREPROCESS_NPROC//len(solver.data_filenames))
 
-            # process synthetics
-            syn = self.apply_filter(syn)
-            syn = self.apply_mute(syn)
-            syn = self.apply_normalize(syn)
-            # syn = self.apply_csg_mute(syn)
-            # syn = self.apply_downsampling(syn)
+        # mute windows are shared by all channels, and so are determined
+        # before channels are processed concurrently
+        windows = self.prepare_mute(path, solver.data_filenames[0])
 
+        def prepare(filename):
+            if PAR.VECTORIZE:
+                return self.prepare_section(path, filename, nchunks, windows)
+            else:
+                return self.prepare_traces(path, filename, windows)
 
-            if PAR.MISFIT:
-                self.write_residuals(path, syn, obs)
+        residuals = pmap(prepare, solver.data_filenames,
+            PAR.PREPROCESS_NPROC, PAR.PREPROCESS_POOL == 'process')
 
-            self.write_adjoint_traces(path+'/'+'traces/adj', syn, obs,
-                                      filename)
+        if PAR.MISFIT:
+            self.save_residuals(path, residuals)
 
-    def write_residuals(self, path, syn, obs):
+    def prepare_traces(self, path, channel, windows=None):
         """
-        Computes residuals
+        Processes traces of given channel and writes "adjoint traces",
+        evaluating misfit and adjoint trace together for each receiver
 
-        :input path: location "adjoint traces" will be written
-        :input syn: obspy Stream object containing synthetic data
-        :input obs: obspy Stream object containing observed data
+        :input path: directory containing observed and synthetic seismic data
+        :input channel: channel or component code used by reader and writer
+        :input windows: optional mute windows, see prepare_mute
+        :output residuals: array of residuals, one per receiver
         """
+        obs = self.reader(path+'/'+'traces/obs', channel)
+        syn = self.reader(path+'/'+'traces/syn', channel)
+
+        obs = self.process_traces(obs, windows)
+        syn = self.process_traces(syn, windows)
+
         nt, dt, _ = self.get_time_scheme(syn)
         nn, _ = self.get_network_size(syn)
 
+        # analytic signals shared by misfit and adjoint, if needed
+        kwargs = self.analytic_signals(
+            np.array([tr.data for tr in syn]),
+            np.array([tr.data for tr in obs]))
+
         residuals = []
+        adj = syn
         for ii in range(nn):
-            residuals.append(self.misfit(syn[ii].data, obs[ii].data, nt, dt))
+            rsd, adj[ii].data = self.misfit_adjoint(
+                syn[ii].data, obs[ii].data, nt, dt,
+                **dict((key, val[ii]) for key, val in kwargs.items()))
+            residuals += [rsd]
+
+        self.writer(adj, path+'/'+'traces/adj', channel)
+
+        return np.array(residuals)
+
+    def process_traces(self, traces, windows=None):
+        """ Applies filter, mute and normalization to traces
+
+          :input traces: obspy Stream object
+          :input windows: optional mute windows, see prepare_mute
+        """
+        traces = self.apply_filter(traces)
+        traces = self.apply_mute(traces, windows)
+        traces = self.apply_normalize(traces)
+        # traces = self.apply_csg_mute(traces)
+        # traces = self.apply_downsampling(traces)
+        return traces
+
+    def misfit_adjoint(self, syn, obs, nt, dt, **kwargs):
+        """
+        Evaluates misfit and adjoint trace in a single pass, so that
+        intermediate results such as traveltime lags are computed once
+
+        :input syn: synthetic trace or record section of shape (nr, nt)
+        :input obs: observed trace or record section of shape (nr, nt)
+        :input kwargs: optional arguments shared by misfit and adjoint
+        :output rsd: residual(s), or None if no misfit is in use
+        :output adj: adjoint trace(s)
+        """
+        if not PAR.MISFIT:
+            return None, self.adjoint(syn, obs, nt, dt)
+
+        rsd = self.misfit(syn, obs, nt, dt, **kwargs)
+
+        if PAR.MISFIT in ['Traveltime', 'TraveltimeInexact', 'Envelope3']:
+            # adjoint traces are scaled by the time lags just computed
+            kwargs['tau'] = rsd
+
+        return rsd, self.adjoint(syn, obs, nt, dt, **kwargs)
+
+    def save_residuals(self, path, residuals):
+        """
+        Writes residuals as single-column text file, and their sum of
+        squares as a single binary value, which append_misfit later adds to
+        a record shared by all sources
 
-        filename = path+'/'+'residuals'
-        if exists(filename):
-            residuals.extend(list(np.loadtxt(filename)))
+        :input path: location residuals will be written
+        :input residuals: list of residual arrays, e.g. one per channel
+        """
+        residuals = np.hstack(residuals)
+        np.savetxt(path+'/'+'residuals', residuals)
+        np.array(np.sum(residuals**2.), dtype='f8').tofile(path+'/'+'misfit')
+
+    def append_misfit(self, src, dst, taskid):
+        """
+        Appends partial misfit written by save_residuals to binary record
+
+        :input src: file written by save_residuals
+        :input dst: record file, created if it does not exist
+        :input taskid: index of task, used to discard outdated entries
+        """
+        record = np.zeros(1, dtype=MISFIT_RECORD)
+        record['task'] = taskid
+        record['misfit'] = np.fromfile(src, dtype='f8')[0]
+
+        # a single small append is atomic, so that entries of concurrent
+        # tasks do not interleave
+        fd = os.open(dst, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record.tostring())
+        finally:
+            os.close(fd)
+
+    def sum_misfit(self, filename):
+        """
+        Sums partial misfits in record written by append_misfit
+
+        If a task appears more than once, e.g. after being resubmitted, only
+        its last entry is used
 
-        np.savetxt(filename, residuals)
+        :input filename: record file
+        :output total_misfit: sum of squares of residuals
+        """
+        records = np.fromfile(filename, dtype=MISFIT_RECORD)[::-1]
+        _, last = np.unique(records['task'], return_index=True)
+        return np.sum(records['misfit'][last])
 
     def sum_residuals(self, files):
         """
@@ -155,23 +274,139 @@ class base(object):
             total_misfit += np.sum(np.loadtxt(filename)**2.)
         return total_misfit
 
-    def write_adjoint_traces(self, path, syn, obs, channel):
+    def prepare_section(self, path, channel, nchunks=1, windows=None):
         """
-        Writes "adjoint traces" required for gradient computation
+        Vectorized counterpart of trace by trace processing in
+        prepare_eval_grad, used if PAR.VECTORIZE is set. Data are held in
+        arrays of shape (nr, nt), so that each processing step, misfit and
+        adjoint evaluation acts on all receivers at once.
+
+        :input path: directory containing observed and synthetic seismic data
+        :input channel: channel or component code used by reader and writer
+        :input nchunks: number of chunks of receivers for which misfit and
+            adjoint are evaluated concurrently
+        :input windows: optional mute windows, see prepare_mute
+        :output residuals: array of residuals, one per receiver
+        """
+        nt, dt, _ = self.get_time_scheme(None)
+
+        obs = readers.SuSection(path+'/'+'traces/obs/'+channel, PAR.NT)
+        syn = readers.SuSection(path+'/'+'traces/syn/'+channel, PAR.NT)
+
+        d_obs = self.process_section(obs, windows)
+        d_syn = self.process_section(syn, windows)
+
+        def evaluate(rows):
+            return self.misfit_adjoint(d_syn[rows], d_obs[rows], nt, dt,
+                **self.analytic_signals(d_syn[rows], d_obs[rows]))
+
+        # receivers are independent, so chunks can be evaluated concurrently
+        chunks = [slice(k[0], k[-1]+1) for k in
+            np.array_split(np.arange(len(d_syn)), nchunks) if len(k)]
+        results = pmap(evaluate, chunks, nchunks)
 
-        :input path: location "adjoint traces" will be written
-        :input syn: obspy Stream object containing synthetic data
-        :input obs: obspy Stream object containing observed data
-        :input channel: channel or component code used by writer
+        if PAR.MISFIT:
+            residuals = np.concatenate([rsd for rsd, _ in results])
+        else:
+            residuals = None
+        adj = np.vstack([adj for _, adj in results])
+
+        writers.writeSuSection(adj, syn.headers,
+                               path+'/'+'traces/adj/'+channel)
+
+        return residuals
+
+    def analytic_signals(self, syn, obs):
+        """ Computes analytic signals of synthetics and observations once,
+          so that misfit and adjoint functions based on them can share them
+
+          :input syn: synthetic data array of shape (nr, nt)
+          :input obs: observed data array of shape (nr, nt)
+          :output kwargs: keyword arguments for misfit and adjoint functions,
+              empty if these do not use analytic signals
         """
-        nt, dt, _ = self.get_time_scheme(syn)
-        nn, _ = self.get_network_size(syn)
+        if PAR.MISFIT not in [
+                'Envelope',
+                'Envelope3',
+                'InstantaneousPhase',
+                'InstantaneousPhase2']:
+            return {}
+
+        asyn, aobs = misfit.analytic(syn, obs)
+        return {'asyn': asyn, 'aobs': aobs}
+
+    def process_section(self, section, windows=None):
+        """ Applies filter, mute and normalization to record section
+
+          :input section: SuSection object
+          :input windows: optional mute windows, see prepare_mute
+          :output s: processed data array of shape (nr, nt)
+        """
+        s = np.array(section.data, dtype='float32')
+        s = self.filter_section(s, 1./section.delta)
+        s = self.mute_section(s, windows, lambda: (
+            section.source_coords(),
+            section.receiver_coords()))
+        s = self.normalize_section(s)
+        return s
+
+    def filter_section(self, s, df):
+        if not PAR.FILTER:
+            return s
 
-        adj = syn
-        for ii in range(nn):
-            adj[ii].data = self.adjoint(syn[ii].data, obs[ii].data, nt, dt)
+        s = signal.sdetrend(s)
+        s = signal.staper(s, 0.05)
+
+        if PAR.FILTER == 'Bandpass':
+            s = signal.sbandpass(s, PAR.FREQMIN, PAR.FREQMAX, df)
 
-        self.writer(adj, path, channel)
+        elif PAR.FILTER == 'Lowpass':
+            s = signal.slowpass(s, PAR.FREQ, df)
+
+        elif PAR.FILTER == 'Highpass':
+            s = signal.shighpass(s, PAR.FREQ, df)
+
+        else:
+            raise ParameterError()
+
+        return s
+
+    def mute_section(self, s, windows=None, coords=None):
+        if not PAR.MUTE:
+            return s
+
+        if windows is None:
+            windows = self.get_mute_windows(None, coords)
+
+        # masks are expanded a block of receivers at a time, to limit memory
+        nrows = max(1, 2**22//PAR.NT)
+        for i in range(0, len(s), nrows):
+            s[i:i+nrows] *= self.mute_mask(windows, slice(i, i+nrows))
+        return s
+
+    def normalize_section(self, s):
+        if not PAR.NORMALIZE:
+            return s
+
+        if 'NormalizeEventsL1' in PAR.NORMALIZE:
+            # normalize event by L1 norm of all traces
+            s /= np.sum(np.abs(s))
+
+        elif 'NormalizeEventsL2' in PAR.NORMALIZE:
+            # normalize event by L2 norm of all traces
+            s /= np.sum(np.sqrt(np.sum(s*s, axis=1)))
+
+        if 'NormalizeTracesL1' in PAR.NORMALIZE:
+            # normalize each trace by its L1 norm
+            w = np.sum(np.abs(s), axis=1)
+            s[w > 0] /= w[w > 0, np.newaxis]
+
+        elif 'NormalizeTracesL2' in PAR.NORMALIZE:
+            # normalize each trace by its L2 norm
+            w = np.sqrt(np.sum(s*s, axis=1))
+            s[w > 0] /= w[w > 0, np.newaxis]
+
+        return s
 
     # Signal processing
     def apply_filter(self, traces):
@@ -211,39 +446,120 @@ class base(object):
 
         return traces
 
-    def apply_mute(self, traces):
+    def apply_mute(self, traces, windows=None):
         if not PAR.MUTE:
             return traces
 
+        if windows is None:
+            windows = self.get_mute_windows(None, lambda: (
+                self.get_source_coords(traces),
+                self.get_receiver_coords(traces)))
+
+        for ir, tr in enumerate(traces):
+            tr.data *= self.mute_mask(windows, slice(ir, ir+1))[0]
+
+        return traces
+
+    def prepare_mute(self, path, channel):
+        """ Returns mute windows of the sources and receivers whose data are
+          in the given directory, or None if no mutes are in use
+
+          Windows are cached in the directory, see get_mute_windows, and
+          coordinates are read from synthetics of the given channel
+        """
+        if not PAR.MUTE:
+            return None
+
+        def coords():
+            syn = readers.SuSection(path+'/'+'traces/syn/'+channel, PAR.NT)
+            return syn.source_coords(), syn.receiver_coords()
+
+        return self.get_mute_windows(path, coords)
+
+    def get_mute_windows(self, path, coords):
+        """ Returns onsets of the tapers of early and late arrival mutes and
+          flags of traces kept by offset mutes, one entry per receiver
+
+          Since source-receiver geometry does not change during an inversion,
+          windows are cached in the given directory, if any, along with the
+          mute parameters they were computed from. Masks are expanded from
+          them in memory by mute_mask.
+
+          :input path: directory in which windows are cached, or None
+          :input coords: function returning source and receiver coordinates,
+              called only if windows are not already cached
+        """
+        key = self.mute_key()
+        filename = path+'/'+'mute_windows.npz' if path else None
+
+        if filename and exists(filename):
+            with np.load(filename) as f:
+                windows = dict(f)
+            if str(windows.pop('key')) == key:
+                return windows
+
+        s_coords, r_coords = coords()
+        offsets = signal.offsets(s_coords, r_coords)
+        windows = {'keep': np.ones(len(offsets), dtype=bool)}
+
         if 'MuteEarlyArrivals' in PAR.MUTE:
-            traces = signal.mute_early_arrivals(traces,
+            windows['early'] = signal.mask_onsets(
                 PAR.MUTE_EARLY_ARRIVALS_SLOPE,  # (units: time/distance)
                 PAR.MUTE_EARLY_ARRIVALS_CONST,  # (units: time)
-                self.get_time_scheme(traces),
-                self.get_source_coords(traces),
-                self.get_receiver_coords(traces))
+                offsets,
+                self.get_time_scheme(None))
 
         if 'MuteLateArrivals' in PAR.MUTE:
-            traces = signal.mute_late_arrivals(traces,
+            windows['late'] = signal.mask_onsets(
                 PAR.MUTE_LATE_ARRIVALS_SLOPE,  # (units: time/distance)
                 PAR.MUTE_LATE_ARRIVALS_CONST,  # (units: time)
-                self.get_time_scheme(traces),
-                self.get_source_coords(traces),
-                self.get_receiver_coords(traces))
+                offsets,
+                self.get_time_scheme(None))
 
         if 'MuteShortOffsets' in PAR.MUTE:
-            traces = signal.mute_short_offsets(traces,
-                PAR.MUTE_SHORT_OFFSETS_DIST,
-                self.get_source_coords(traces),
-                self.get_receiver_coords(traces))
+            windows['keep'][offsets < PAR.MUTE_SHORT_OFFSETS_DIST] = False
 
         if 'MuteLongOffsets' in PAR.MUTE:
-            traces = signal.mute_long_offsets(traces,
-                PAR.MUTE_LONG_OFFSETS_DIST,
-                self.get_source_coords(traces),
-                self.get_receiver_coords(traces))
+            windows['keep'][offsets > PAR.MUTE_LONG_OFFSETS_DIST] = False
 
-        return traces
+        if filename:
+            # written under a temporary name and renamed, so that readers
+            # never see a partial file
+            fd, tmpname = tempfile.mkstemp(suffix='.npz', dir=path)
+            os.close(fd)
+            np.savez(tmpname, key=key, **windows)
+            os.rename(tmpname, filename)
+
+        return windows
+
+    def mute_key(self):
+        """ Returns string identifying the mute parameters in effect
+        """
+        return repr([sorted(PAR.MUTE), self.get_time_scheme(None)] + [
+            getattr(PAR, name, None) for name in [
+                'MUTE_EARLY_ARRIVALS_SLOPE',
+                'MUTE_EARLY_ARRIVALS_CONST',
+                'MUTE_LATE_ARRIVALS_SLOPE',
+                'MUTE_LATE_ARRIVALS_CONST',
+                'MUTE_SHORT_OFFSETS_DIST',
+                'MUTE_LONG_OFFSETS_DIST']])
+
+    def mute_mask(self, windows, rows=slice(None)):
+        """ Expands mute windows of given receivers into array of shape
+          (nrows, nt) combining all mutes in PAR.MUTE
+        """
+        nt, _, _ = self.get_time_scheme(None)
+        keep = windows['keep'][rows]
+        mask = np.ones((len(keep), nt))
+
+        if 'early' in windows:
+            mask *= signal.onset_masks(windows['early'][rows], nt)
+
+        if 'late' in windows:
+            mask *= 1.-signal.onset_masks(windows['late'][rows], nt)
+
+        mask[~keep] = 0.
+        return mask
 
     def apply_normalize(self, traces):
         if not PAR.NORMALIZE:
@@ -282,27 +598,17 @@ class base(object):
         return traces
 
     def apply_csg_mute(self, traces):
-        for tr in traces:
-            tr.data = self.csg_mute(tr.data, PAR.T, PAR.T1)
+        picks = [np.argmax(tr.data) for tr in traces]
+        tapers = signal.csg_tapers(picks, len(traces[0].data), PAR.T, PAR.T1)
+        for tr, tapering in zip(traces, tapers):
+            tr.data = tr.data * tapering
         return traces
 
     def csg_mute(self, seismo_w, T, T1):
     # T = 10
     # T1 = 10000
         nt = len(seismo_w)
-        tapering = np.zeros(nt)
-        tau_o = np.argmax(seismo_w)
-        b1 = tau_o - 0.5 * T1
-        b2 = tau_o + 0.5 * T1
-        for j in range(nt):
-            if j < b1 -10 * T:
-                tapering[j] = 0
-            elif j >= b1 - 20 * T and j <= b1:
-                tapering[j] = np.exp(-(j-tau_o)**2/2*(2*T)**2)
-            elif j >= b1 and j <= b2:
-                tapering[j] = 1
-            else :
-                tapering[j] = np.exp(-(j-b2)**2/2*(2*T)**2)
+        tapering = signal.csg_tapers([np.argmax(seismo_w)], nt, T, T1)[0]
         return seismo_w * tapering
 
     def apply_filter_backwards(self, traces):
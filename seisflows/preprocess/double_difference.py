@@ -12,10 +12,13 @@ from os.path import exists
 # Import Numpy and Obspy
 import numpy as np
 from obspy.core import Stream, Trace
+from scipy import sparse
+from scipy.spatial import cKDTree
 
 # Local imports
 from seisflows.plugins import adjoint, misfit
 from seisflows.tools import unix
+from seisflows.tools.tools import savenpy
 from seisflows.config import ParameterError, custom_import
 
 try:
@@ -54,63 +57,71 @@ class double_difference(custom_import('preprocess', 'base')):
             'Traveltime',
             'TraveltimeInexact']
 
+        # pairwise processing is not available for record section arrays
+        assert not PAR.VECTORIZE
+
+        # pairwise intermediates of all channels are written to same files
+        assert PAR.PREPROCESS_NPROC == 1
+
+    def prepare_traces(self, path, channel, windows=None):
+        """ Processes traces of given channel and writes adjoint traces
+
+          Unlike in the base class, residuals of all station pairs must be
+          known before adjoint traces can be computed
+        """
+        obs = self.reader(path+'/'+'traces/obs', channel)
+        syn = self.reader(path+'/'+'traces/syn', channel)
+
+        obs = self.process_traces(obs, windows)
+        syn = self.process_traces(syn, windows)
+
+        rsd = self.write_residuals(path, syn, obs)
+        self.write_adjoint_traces(path+'/'+'traces/adj', syn, obs, channel)
+
+        return rsd
+
     def write_residuals(self, path, syn, dat):
         """ Computes residuals from observations and synthetics
+
+          Pairwise lags are written to disk for use by write_adjoint_traces;
+          residuals are returned
         """
         nt, dt, _ = self.get_time_scheme(syn)
         nr, _ = self.get_network_size(syn)
         rx, ry, rz = self.get_receiver_coords(syn)
 
-        dist = np.zeros((nr, nr))
-        count = np.zeros(nr)
-        delta_syn = np.zeros((nr, nr))
-        delta_obs = np.zeros((nr, nr))
+        # find station pairs closer than DISTMAX
+        i, j, dist = self.pairs(rx, ry)
 
-        # calculate distances between stations
-        for i in range(nr):
-            for j in range(i):
-                dist[i, j] = self.distance(rx[i], rx[j], ry[i], ry[j])
+        delta_syn = np.zeros(len(i))
+        delta_obs = np.zeros(len(i))
 
         # calculate traveltime lags between stations pairs
-        for i in range(nr):
-            for j in range(i):
-                if dist[i, j] > PAR.DISTMAX:
-                    continue
-                delta_syn[i, j] = self.misfit(syn[i].data, syn[j].data, nt, dt)
-                delta_obs[i, j] = self.misfit(dat[i].data, dat[j].data, nt, dt)
-                delta_syn[j, i] = -delta_syn[i, j]
-                delta_obs[j, i] = -delta_obs[i, j]
-                count[i] += 1
-
-        np.savetxt(path + '/' + 'dist_ij', dist)
-        np.savetxt(path + '/' + 'count', count)
-        np.savetxt(path + '/' + 'delta_syn_ij', delta_syn)
-        np.savetxt(path + '/' + 'delta_obs_ij', delta_obs)
-        np.savetxt(path + '/' + 'rsd_ij', delta_syn-delta_obs)
+        s = np.array([trace.data for trace in syn])
+        d = np.array([trace.data for trace in dat])
+
+        for k in self.batches(len(i), nt):
+            delta_syn[k] = self.misfit(s[i[k]], s[j[k]], nt, dt)
+            delta_obs[k] = self.misfit(d[i[k]], d[j[k]], nt, dt)
+
+        count = np.bincount(i, minlength=nr).astype(float)
+
+        # only pairs i > j are stored, since lags are antisymmetric
+        self.save_pairs(path + '/' + 'dist_ij', i, j, dist, nr)
+        self.save_pairs(path + '/' + 'delta_syn_ij', i, j, delta_syn, nr)
+        self.save_pairs(path + '/' + 'delta_obs_ij', i, j, delta_obs, nr)
+        self.save_pairs(path + '/' + 'rsd_ij', i, j, delta_syn-delta_obs, nr)
+        savenpy(path + '/' + 'count', count)
 
         # to get residuals, sum over all station pairs
-        rsd = abs(delta_syn-delta_obs).sum(axis=0)
+        rsd = np.bincount(i, abs(delta_syn-delta_obs), minlength=nr) + \
+              np.bincount(j, abs(delta_syn-delta_obs), minlength=nr)
 
         # apply optional weights
         if PATH.WEIGHTS:
             rsd *= self.load_weights()
 
-        # write residuals to text file
-        filename = path + '/' + 'residuals'
-        if exists(filename):
-            rsdlist = list(np.loadtxt(filename))
-        else:
-            rsdlist = []
-        rsdlist += [rsd]
-        np.savetxt(filename, rsdlist)
-
-    def sum_residuals(self, files):
-        """ Sums squares of residuals
-        """
-        total_misfit = 0.
-        for path in files:
-            total_misfit += np.sum(np.loadtxt(path)**2.)
-        return total_misfit
+        return rsd
 
     def write_adjoint_traces(self, path, syn, dat, channel):
         """ Computes adjoint traces from observed and synthetic traces
@@ -118,26 +129,36 @@ class double_difference(custom_import('preprocess', 'base')):
         nt, dt, _ = self.get_time_scheme(syn)
         nr, _ = self.get_network_size(syn)
 
-        Del = np.loadtxt(path + '/' + '../../delta_syn_ij')
-        rsd = np.loadtxt(path + '/' + '../../rsd_ij')
+        i, j, Del = self.load_pairs(path + '/' + '../../delta_syn_ij')
+        _, _, rsd = self.load_pairs(path + '/' + '../../rsd_ij')
 
         # initialize trace arrays
         adj = Stream()
-        for i in range(nr):
+        for ir in range(nr):
             adj.append(Trace(
                 data=np.zeros(nt, dtype='float32'),
-                header=syn[i].stats))
+                header=syn[ir].stats))
+
+        # velocity traces are computed once per shot
+        v = self.velocity(np.array([trace.data for trace in syn]), dt)
+        a = np.zeros((nr, nt))
+
+        # shifted velocity traces of each batch are written to a single
+        # buffer, then summed into adjoint traces by sparse products
+        buf = np.empty((min(len(i), self.batchsize(nt)), nt))
+
+        for k in self.batches(len(i), nt):
+            ik, jk = i[k], j[k]
+            out = buf[:len(ik)]
 
-        # generate adjoint traces
-        for i in range(nr):
-            for j in range(i):
-                si = syn[i].data
-                sj = syn[j].data
+            self.shift_velocity(v, jk, +Del[k], dt, out)
+            a += self.scatter(ik, +rsd[k], nr).dot(out)
 
-                adj[i].data += rsd[i, j] * \
-                               self.adjoint_dd(si, sj, +Del[i, j], nt, dt)
-                adj[j].data -= rsd[i, j] * \
-                               self.adjoint_dd(sj, si, -Del[i, j], nt, dt)
+            self.shift_velocity(v, ik, -Del[k], dt, out)
+            a += self.scatter(jk, -rsd[k], nr).dot(out)
+
+        for ir in range(nr):
+            adj[ir].data[:] = a[ir]
 
         # optional weighting
         adj = self.apply_weights(adj)
@@ -145,24 +166,67 @@ class double_difference(custom_import('preprocess', 'base')):
         # write adjoint traces
         self.writer(adj, path, channel)
 
+    def save_pairs(self, filename, i, j, values, nr):
+        """ Writes values defined on station pairs as sparse binary matrix
+        """
+        sparse.save_npz(filename,
+            sparse.coo_matrix((values, (i, j)), shape=(nr, nr)),
+            compressed=False)
+
+    def load_pairs(self, filename):
+        """ Reads values written by save_pairs
+
+          Returns row and column indices and values, in the order written
+        """
+        m = sparse.load_npz(filename + '.npz')
+        return m.row, m.col, m.data
+
     def adjoint_dd(self, si, sj, t0, nt, dt):
         """ Returns contribution to adjoint source from a single double
             difference measurement
         """
-        vi = np.zeros(nt)
-        vj = np.zeros(nt)
+        v = self.velocity(np.array([sj]), dt)
+        vjo = np.zeros((1, nt))
+
+        return self.shift_velocity(v, [0], [t0], dt, vjo)[0]
+
+    def velocity(self, s, dt):
+        """ Returns central difference time derivatives of traces stored as
+          array of shape (nr, nt)
+        """
+        v = np.zeros(s.shape)
+        v[:, 1:-1] = (s[:, 2:] - s[:, 0:-2])/(2.*dt)
+        return v
+
+    def shift_velocity(self, v, rows, t0, dt, out):
+        """ Shifts given rows of velocity array by -t0 and normalizes them
+          by their maximum, writing results to out
+        """
+        nt = v.shape[1]
+        it = np.floor(-np.asarray(t0)/dt).astype(int)
 
-        vi[1:-1] = (si[2:] - si[0:-2])/(2.*dt)
-        vj[1:-1] = (sj[2:] - sj[0:-2])/(2.*dt)
+        # flat index of source sample for each output sample
+        k = np.arange(nt) - it[:, np.newaxis]
+        valid = (k >= 0) & (k < nt)
+        np.clip(k, 0, nt-1, out=k)
+        k += (np.asarray(rows)*nt)[:, np.newaxis]
 
-        vjo = self.shift(vj, int(np.floor(-t0/dt)))
+        np.take(v, k, out=out)
+        out[~valid] = 0.
 
-        w = sum(vi*vjo*dt)
-        w = max(vjo)
-        if w:
-            vjo /= w
+        w = out.max(axis=1)
+        w[w == 0] = 1.
+        out /= w[:, np.newaxis]
 
-        return vjo
+        return out
+
+    def scatter(self, rows, weights, nr):
+        """ Returns sparse matrix which sums weighted pair contributions
+          into rows of adjoint trace array
+        """
+        n = len(rows)
+        return sparse.csr_matrix((weights, (rows, np.arange(n))),
+            shape=(nr, n))
 
     def apply_weights(self, traces):
         if not PATH.WEIGHTS:
@@ -193,6 +257,62 @@ class double_difference(custom_import('preprocess', 'base')):
             vo[:it] = v[-it:]
         return vo
 
+    def pairs(self, rx, ry):
+        """ Returns indices i > j and distances of all station pairs within
+          DISTMAX of each other
+
+          Pairs are found using a KD-tree, so that cost scales with number of
+          nearby pairs rather than with number of stations squared. Distance
+          is measured between (rx[i], ry[i]) and (rx[j], ry[j])
+        """
+        rx = np.asarray(rx, dtype=float)
+        ry = np.asarray(ry, dtype=float)
+        nr = len(rx)
+
+        if PAR.UNITS in ['lonlat']:
+            # represent stations as unit vectors, so that great circle
+            # distance corresponds to chord length
+            lon, lat = np.radians(rx), np.radians(ry)
+            points = np.column_stack((
+                np.cos(lat)*np.cos(lon),
+                np.cos(lat)*np.sin(lon),
+                np.sin(lat)))
+            radius = 2.*np.sin(np.radians(min(PAR.DISTMAX, 180.))/2.)
+            complete = PAR.DISTMAX >= 180.
+        else:
+            points = np.column_stack((rx, ry))
+            radius = PAR.DISTMAX
+            complete = np.isinf(PAR.DISTMAX)
+
+        if complete:
+            i, j = np.tril_indices(nr, -1)
+        else:
+            # pad search radius slightly; exact distances are checked below
+            ij = cKDTree(points).query_pairs(radius*(1.+1.e-6) + 1.e-12,
+                output_type='ndarray')
+            i, j = ij.max(axis=1), ij.min(axis=1)
+
+        order = np.lexsort((j, i))
+        i, j = i[order], j[order]
+
+        dist = self.distance(rx[i], ry[i], rx[j], ry[j])
+        keep = dist <= PAR.DISTMAX
+
+        return i[keep], j[keep], dist[keep]
+
+    def batches(self, npairs, nt):
+        """ Yields slices over station pairs, limiting memory used by
+          pairwise arrays of length nt
+        """
+        step = self.batchsize(nt)
+        for k in range(0, npairs, step):
+            yield slice(k, k+step)
+
+    def batchsize(self, nt, size=2**22):
+        """ Returns number of station pairs processed at once
+        """
+        return max(1, size//max(nt, 1))
+
     def distance(self, x1, y1, x2, y2):
         if PAR.UNITS in ['lonlat']:
             dlat = np.radians(y2-y1)
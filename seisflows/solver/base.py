@@ -18,10 +18,10 @@ import numpy as np
 
 # Local imports
 from seisflows.config import ParameterError, custom_import
-from seisflows.plugins import solver_io
+from seisflows.plugins import readers, solver_io, writers
 from seisflows.tools import msg, unix
 from seisflows.tools.seismic import Container, call_solver
-from seisflows.tools.tools import Struct, diff, exists
+from seisflows.tools.tools import Struct, diff, exists, pmap
 
 try:
     PAR = sys.modules['seisflows_parameters']
@@ -106,6 +106,15 @@ class base(object):
         if 'SOLVERIO' not in PAR:
             setattr(PAR, 'SOLVERIO', 'fortran_binary')
 
+        # number of threads used for reading and writing model slices
+        if 'IO_THREADS' not in PAR:
+            setattr(PAR, 'IO_THREADS', 1)
+
+        # export residuals of each receiver as text, in addition to misfit
+        # record
+        if 'EXPORT_RESIDUALS' not in PAR:
+            setattr(PAR, 'EXPORT_RESIDUALS', True)
+
         # solver scratch paths
         if 'SCRATCH' not in PATH:
             raise ParameterError(PATH, 'SCRATCH')
@@ -213,8 +222,22 @@ class base(object):
         self.forward()
 
         if write_residuals:
-            preprocess.prepare_eval_grad(self.cwd)
-            self.export_residuals(path)
+            self.eval_residuals(path)
+
+    def eval_residuals(self, path=''):
+        """
+          Writes residuals and adjoint traces, once forward simulations have
+          been carried out by eval_func
+
+          Calling eval_func with write_residuals=False and then this method
+          as a separate task lets systems overlap preprocessing of one source
+          with simulations of others
+
+          :input path :: directory to which residuals are exported
+        """
+        unix.cd(self.cwd)
+        preprocess.prepare_eval_grad(self.cwd)
+        self.export_residuals(path)
 
     def eval_grad(self, path='', export_traces=False):
         """
@@ -268,7 +291,7 @@ class base(object):
         """
         return getattr(solver_io, PAR.SOLVERIO)
 
-    def load(self, path, parameters=[], prefix='', suffix=''):
+    def load(self, path, parameters=[], prefix='', suffix='', mmap=False):
         """
           Loads SPECFEM2D/3D models or kernels
 
@@ -277,16 +300,48 @@ class base(object):
               (if empty, defaults to self.parameters)
           :input prefix :: optional filename prefix
           :input suffix :: optional filename suffix, eg '_kernel'
+          :input mmap :: return read-only memory maps instead of reading
+              slices into memory; each map holds its file open, so use
+              load_merged to read many slices into a single vector
           :output dict :: model or kernels indexed by material parameter
               and processor rank, ie dict[parameter][iproc]
         """
+        def read(slice):
+            key, iproc = slice
+            return self.io.read_slice(path, prefix+key+suffix, iproc,
+                                      mmap=mmap)
+
+        slices = self._slices(parameters or self.parameters)
+        vals = pmap(read, slices, PAR.IO_THREADS)
+
         dict = Container()
-        for iproc in range(self.mesh_properties.nproc):
-            for key in parameters or self.parameters:
-                dict[key] += self.io.read_slice(
-                    path, prefix+key+suffix, iproc)
+        for (key, _), val in zip(slices, vals):
+            dict[key] += val
         return dict
 
+    def load_merged(self, path, parameters=[], prefix='', suffix=''):
+        """ Loads SPECFEM2D/3D models or kernels in vector representation
+
+          Equivalent to merge(load(...)), except that each slice is memory
+          mapped and copied into the preallocated vector as soon as it is
+          read, so that no more than PAR.IO_THREADS files are open at once
+        """
+        keys = parameters or self.parameters
+        offsets = self._offsets()
+        n = offsets[-1]
+
+        m = np.empty(len(keys)*n, dtype='float32')
+
+        def read(slice):
+            key, iproc = slice
+            imin = n*keys.index(key) + offsets[iproc]
+            imax = n*keys.index(key) + offsets[iproc+1]
+            m[imin:imax] = self.io.read_slice(path, prefix+key+suffix, iproc,
+                                              mmap=True)[0]
+
+        pmap(read, self._slices(keys), PAR.IO_THREADS)
+        return m
+
     def save(self, dict, path, parameters=['vp', 'vs', 'rho'],
              prefix='', suffix=''):
         """
@@ -302,40 +357,67 @@ class base(object):
 
         # fill in any missing parameters
         missing_keys = diff(parameters, dict.keys())
-        for iproc in range(self.mesh_properties.nproc):
+        if missing_keys:
+            missing = self.load(PATH.MODEL_INIT, missing_keys, prefix, suffix)
             for key in missing_keys:
-                dict[key] += self.io.read_slice(
-                    PATH.MODEL_INIT, prefix+key+suffix, iproc)
+                dict[key] = missing[key]
 
         # write slices to disk
-        for iproc in range(self.mesh_properties.nproc):
-            for key in parameters:
-                self.io.write_slice(
-                    dict[key][iproc], path, prefix+key+suffix, iproc)
+        def write(slice):
+            key, iproc = slice
+            self.io.write_slice(
+                dict[key][iproc], path, prefix+key+suffix, iproc)
+
+        pmap(write, self._slices(parameters), PAR.IO_THREADS)
 
     def merge(self, model, parameters=[]):
         """ Converts model from dictionary to vector representation
+
+          The vector is allocated once, as a contiguous single precision
+          array, and filled slice by slice
         """
-        m = np.array([])
-        for key in parameters or self.parameters:
+        keys = parameters or self.parameters
+        offsets = self._offsets()
+        n = offsets[-1]
+
+        m = np.empty(len(keys)*n, dtype='float32')
+        for idim, key in enumerate(keys):
             for iproc in range(self.mesh_properties.nproc):
-                m = np.append(m, model[key][iproc])
+                imin = n*idim + offsets[iproc]
+                imax = n*idim + offsets[iproc+1]
+                m[imin:imax] = model[key][iproc]
         return m
 
     def split(self, m, parameters=[]):
         """ Converts model from vector to dictionary representation
+
+          Slices are returned as views into the given vector, not copies
         """
-        nproc = self.mesh_properties.nproc
-        ngll = self.mesh_properties.ngll
+        offsets = self._offsets()
+        n = offsets[-1]
+
         model = Container()
         for idim, key in enumerate(parameters or self.parameters):
             model[key] = []
-            for iproc in range(nproc):
-                imin = sum(ngll)*idim + sum(ngll[:iproc])
-                imax = sum(ngll)*idim + sum(ngll[:iproc+1])
+            for iproc in range(self.mesh_properties.nproc):
+                imin = n*idim + offsets[iproc]
+                imax = n*idim + offsets[iproc+1]
                 model[key] += [m[imin:imax]]
         return model
 
+    def _slices(self, parameters):
+        """ Lists (parameter, processor rank) pairs of all model slices
+        """
+        return [(key, iproc)
+                for iproc in range(self.mesh_properties.nproc)
+                for key in parameters]
+
+    def _offsets(self):
+        """ Returns position of each slice within a single material
+          parameter block of the model vector
+        """
+        return np.cumsum([0] + list(self.mesh_properties.ngll))
+
     # Postprocessing wrappers
 
     def combine(self, input_path='', output_path='', parameters=[]):
@@ -410,9 +492,10 @@ class base(object):
     def export_model(self, path, parameters=['rho', 'vp', 'vs']):
         if self.taskid == 0:
             unix.mkdir(path)
+            files = []
             for key in parameters:
-                files = glob(join(self.model_databases, '*'+key+'.bin'))
-                unix.cp(files, path)
+                files += glob(join(self.model_databases, '*'+key+'.bin'))
+            self.copy_files(files, path)
 
     def export_kernels(self, path):
         unix.cd(self.kernel_databases)
@@ -425,6 +508,19 @@ class base(object):
         unix.mv(src, dst)
 
     def export_residuals(self, path):
+        # partial misfit of each source is appended to a single record, from
+        # which total misfit is summed without reading residuals
+        if not exists(path):
+            unix.mkdir(path)
+
+        # no misfit is written unless residuals were evaluated
+        src = join(self.cwd, 'misfit')
+        if PAR.MISFIT and exists(src):
+            preprocess.append_misfit(src, join(path, 'misfit'), self.taskid)
+
+        if not PAR.EXPORT_RESIDUALS:
+            return
+
         unix.mkdir(join(path, 'residuals'))
 
         src = join(self.cwd, 'residuals')
@@ -438,6 +534,11 @@ class base(object):
         dst = join(path, self.source_name)
         unix.cp(src, dst)
 
+    def copy_files(self, files, path):
+        """ Copies files into given directory, using PAR.IO_THREADS threads
+        """
+        pmap(partial(unix.cp, dst=path), files, PAR.IO_THREADS)
+
     def rename_kernels(self):
         """ Works around conflicting kernel filename conventions
         """
@@ -514,6 +615,15 @@ class base(object):
             overwritten with nonzero values later on.
         """
         for filename in self.data_filenames:
+            if PAR.FORMAT in ['SU', 'su']:
+                # write zeros in one pass, reusing headers of observations
+                obs = readers.SuSection(
+                    self.cwd + '/' + 'traces/obs/' + filename, PAR.NT)
+                writers.writeSuSection(np.zeros((len(obs), PAR.NT)),
+                    obs.headers,
+                    self.cwd + '/' + 'traces/adj/' + filename)
+                continue
+
             # read traces
             d = preprocess.reader(self.cwd + '/' + 'traces/obs', filename)
 
@@ -545,7 +655,8 @@ class base(object):
         iproc = 0
         ngll = []
         while True:
-            dummy = self.io.read_slice(path, key, iproc)[0]
+            # only the slice length is needed, so avoid reading the data
+            dummy = self.io.read_slice(path, key, iproc, mmap=True)[0]
             ngll += [len(dummy)]
             iproc += 1
             if not exists('%s/proc%06d_%s.bin' % (path, iproc, key)):
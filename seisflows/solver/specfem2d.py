@@ -225,13 +225,13 @@ class specfem2d(custom_import('solver', 'base')):
     def import_model(self, path):
         src = glob(path + '/' + 'model/*')
         dst = join(self.cwd, 'DATA/')
-        unix.cp(src, dst)
+        self.copy_files(src, dst)
 
     def export_model(self, path):
         unix.mkdir(path)
         src = glob(join(self.cwd, 'DATA/*.bin'))
         dst = path
-        unix.cp(src, dst)
+        self.copy_files(src, dst)
 
     @property
     def data_filenames(self):
@@ -6,16 +6,39 @@
 ###############################################################################
 
 # Import system modules
+import json
+import os
+import signal
+import socket
+import sys
+import time
 from os.path import join
+from uuid import uuid4
+from subprocess import Popen
+from threading import Thread
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 # Local imports
 from seisflows.config import save, saveobj
-from seisflows.tools import unix
+from seisflows.tools import msg, unix
+from seisflows.tools.err import ParameterError
+from seisflows.tools.tools import exists, findpath, loadjson, savejson
+
+try:
+    PAR = sys.modules['seisflows_parameters']
+    PATH = sys.modules['seisflows_paths']
+except:
+    print("Check parameters and paths.")
 
 
 class base(object):
     """ Abstract base class
     """
+    # ledger ids of the latest call of each classname.method
+    calls = None
 
     def check(self):
         """ Checks parameters and paths
@@ -42,11 +65,438 @@ class base(object):
         """
         raise NotImplementedError('Must be implemented by subclass.')
 
+    def progress(self, taskid):
+        """ Provides status update
+        """
+        if PAR.NTASK > 1:
+            print(' task ' + '%02d of %02d' % (taskid+1, PAR.NTASK))
+        else:
+            print(' task running')
+
     def checkpoint(self, path, classname, method, args, kwargs):
         """ Writes information to disk so tasks can be executed remotely
         """
+        self.begin_call(classname, method, kwargs)
         argspath = join(path, 'kwargs')
         argsfile = join(argspath, classname+'_'+method+'.p')
         unix.mkdir(argspath)
         saveobj(argsfile, kwargs)
         save()
+
+    def run_pipeline(self, stages):
+        """ Runs stages, each given as (classname, method, kwargs), for all
+          tasks
+
+          Here each stage is completed for all tasks before the next one
+          begins; systems with local task queues override this to overlap
+          stages of different tasks
+        """
+        for classname, method, kwargs in stages:
+            self.run(classname, method, **kwargs)
+
+    def run_packed(self, classname, method, taskids, args, kwargs):
+        """ Runs tasks side by side within the current allocation
+
+          Used by the PAR.PACKED mode of cluster system classes, in which the
+          workflow job holds PAR.NODES nodes and works through a local task
+          queue, rather than submitting one job per task.
+
+          The allocation is divided into nslots slots of PAR.NPROC cores, and
+          each task is told its slot through SEISFLOWS_SLOT. Under PBS and
+          LSF, mpiexec confines the solver to the cores of the slot, whereas
+          under SLURM, srun places it on free cores itself. Only the solver
+          runs there: the python part of each task, e.g. preprocessing, runs
+          on the node holding the workflow job, so with PAR.NODES > 1 such
+          work of all concurrent tasks shares one node.
+        """
+        self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
+
+        # number of tasks that fit in allocation at once
+        nslots = max(1, PAR.NODES*PAR.NODESIZE//PAR.NPROC)
+
+        self.run_queue(classname, method, taskids, nslots)
+
+    def run_queue(self, classname, method, taskids, nslots):
+        """ Runs tasks as local subprocesses, at most nslots at a time
+
+          Tasks are dispatched longest first, according to runtimes recorded
+          in previous calls. If classname.method is listed in PAR.SPECULATE,
+          tasks still running once the queue is empty are relaunched on idle
+          slots, and the first copy to finish is kept; the others are stopped
+          and waited for before returning. Since copies share the task's
+          working directory, a copy stopped midway could corrupt outputs of
+          the first, so only methods which the task's class lists in its
+          'speculative' attribute, as having no side effects, are allowed.
+
+          Failed tasks are retried up to PAR.MAXTRIES times in all, and tasks
+          the ledger shows as completed in the current call are skipped.
+        """
+        queued = self.dispatch_order(classname, method,
+            self.unfinished(classname, method, taskids))
+        speculate = '%s.%s' % (classname, method) in PAR.SPECULATE
+        if speculate and method not in getattr(
+                sys.modules['seisflows_'+classname], 'speculative', []):
+            raise ParameterError(
+                'SPECULATE, %s.%s may have side effects' % (classname, method))
+        tries = dict((taskid, 1) for taskid in queued)
+
+        done = Queue()
+        running = {}
+        runtimes = {}
+
+        # copies stopped after another copy of the same task finished
+        killed = set()
+
+        # slots not in use, and slot used by each process
+        free = list(range(nslots))
+        slots = {}
+
+        while queued or running:
+            # launch queued tasks
+            while queued and free:
+                taskid = queued.pop(0)
+                self.progress(taskid)
+                slot = free.pop(0)
+                p, start = self._launch(classname, method, taskid, done, slot)
+                running[taskid] = [(p, start)]
+                slots[p] = slot
+
+            # relaunch stragglers on idle slots, longest running first
+            if speculate and not queued:
+                for taskid in sorted(running, key=lambda i: running[i][0][1]):
+                    if not free:
+                        break
+                    if len(running[taskid]) == 1:
+                        slot = free.pop(0)
+                        p, start = self._launch(
+                            classname, method, taskid, done, slot)
+                        running[taskid] += [(p, start)]
+                        slots[p] = slot
+
+            # wait for any copy of any task to complete
+            taskid, p, status = done.get()
+            free.append(slots.pop(p))
+
+            if p in killed:
+                killed.remove(p)
+                continue
+
+            copies = running[taskid]
+            start = [t for q, t in copies if q is p][0]
+            copies[:] = [(q, t) for q, t in copies if q is not p]
+
+            if status == 0:
+                runtimes[taskid] = time.time() - start
+                for q, _ in copies:
+                    self._kill(q)
+                    killed.add(q)
+                running.pop(taskid)
+
+            elif not copies:
+                running.pop(taskid)
+                if tries[taskid] < PAR.MAXTRIES:
+                    tries[taskid] += 1
+                    queued.insert(0, taskid)
+                else:
+                    self.task_error(classname, method, taskid)
+
+        # stopped copies may still be writing
+        while killed:
+            _, p, _ = done.get()
+            killed.discard(p)
+
+        self.save_runtimes(classname, method, runtimes)
+        self.end_call(classname, method)
+
+    def run_stages(self, stages, nslots, ntotal):
+        """ Runs stages, each given as (classname, method, kwargs), for all
+          tasks through local queues, running at most nslots[k] tasks of
+          stage k, and ntotal tasks of all stages, at a time
+
+          As soon as a task completes one stage, it is queued for the next,
+          so that e.g. preprocessing of one source overlaps with simulations
+          of others. Later stages are launched first, so that tasks already
+          started are completed before new ones take up the shared budget.
+          Failed stages are retried as in run_queue.
+        """
+        for classname, method, kwargs in stages:
+            self.checkpoint(PATH.OUTPUT, classname, method, (), kwargs)
+
+        # tasks resume from the first stage they have not completed
+        classname, method, _ = stages[0]
+        queues = [[] for _ in stages]
+        for taskid in self.dispatch_order(classname, method, range(PAR.NTASK)):
+            for k, (classname, method, _) in enumerate(stages):
+                if self.unfinished(classname, method, [taskid]):
+                    queues[k] += [taskid]
+                    break
+        tries = {}
+        nbusy = [0 for _ in stages]
+        runtimes = [{} for _ in stages]
+
+        done = Queue()
+        running = {}
+
+        while any(queues) or running:
+            # launch queued tasks of each stage, latest stage first
+            for k in reversed(range(len(stages))):
+                classname, method, _ = stages[k]
+                while queues[k] and nbusy[k] < nslots[k] and \
+                        sum(nbusy) < ntotal:
+                    taskid = queues[k].pop(0)
+                    if k == 0:
+                        self.progress(taskid)
+                    p, start = self._launch(classname, method, taskid, done)
+                    running[p] = (k, start)
+                    nbusy[k] += 1
+
+            # wait for any task to complete its stage
+            taskid, p, status = done.get()
+            k, start = running.pop(p)
+            nbusy[k] -= 1
+
+            if status != 0:
+                classname, method, _ = stages[k]
+                tries[k, taskid] = tries.get((k, taskid), 1) + 1
+                if tries[k, taskid] > PAR.MAXTRIES:
+                    self.task_error(classname, method, taskid)
+                queues[k].insert(0, taskid)
+                continue
+
+            runtimes[k][taskid] = time.time() - start
+            if k+1 < len(stages):
+                queues[k+1] += [taskid]
+
+        for (classname, method, _), times in zip(stages, runtimes):
+            self.save_runtimes(classname, method, times)
+            self.end_call(classname, method)
+
+    def dispatch_order(self, classname, method, taskids):
+        """ Sorts tasks by decreasing runtime recorded in previous calls;
+          tasks without a record come first
+        """
+        runtimes = self.load_runtimes(classname, method)
+        return sorted(taskids,
+            key=lambda i: -runtimes.get(str(i), float('inf')))
+
+    def load_runtimes(self, classname, method):
+        """ Returns dictionary of recorded runtimes, keyed by taskid
+        """
+        filename = join(PATH.SYSTEM, 'runtimes', classname+'_'+method)
+        if not exists(filename):
+            return {}
+        return loadjson(filename)
+
+    def save_runtimes(self, classname, method, runtimes):
+        """ Records runtimes of tasks, keyed by taskid, updating those
+          recorded in previous calls
+        """
+        if not runtimes:
+            return
+        if not exists(join(PATH.SYSTEM, 'runtimes')):
+            unix.mkdir(join(PATH.SYSTEM, 'runtimes'))
+        filename = join(PATH.SYSTEM, 'runtimes', classname+'_'+method)
+        record = self.load_runtimes(classname, method)
+        record.update((str(i), t) for i, t in runtimes.items())
+        savejson(filename, record)
+
+    # Task ledger
+
+    def begin_call(self, classname, method, kwargs):
+        """ Assigns id under which tasks of the current call of
+          classname.method are recorded in the ledger
+
+          If PAR.RESUME_TASKS is set and the last call of classname.method
+          with the same arguments and model state was interrupted, e.g. by a
+          crash followed by sfresume, its id is kept, so that tasks which
+          completed before the interruption are not run again
+        """
+        if self.calls is None:
+            self.calls = {}
+
+        key = '%s.%s' % (classname, method)
+        signature = repr([sorted(kwargs.items()), self.model_state()])
+        resume = PAR.RESUME_TASKS if 'RESUME_TASKS' in PAR else False
+
+        last = self.calls.get(key)
+        if resume and last and last[0] == signature and not last[2]:
+            return last[1]
+
+        self.calls[key] = [signature, uuid4().hex, False]
+        return self.calls[key][1]
+
+    def model_state(self):
+        """ Returns state of nonlinear optimization, which tells apart
+          calls with same arguments but different models, e.g. trial steps
+          of a line search, including those repeated after a restart
+        """
+        optimize = sys.modules.get('seisflows_optimize')
+        line_search = getattr(optimize, 'line_search', None)
+        return [getattr(optimize, 'iter', None),
+                getattr(optimize, 'restarted', None),
+                getattr(line_search, 'step_lens', None),
+                getattr(line_search, 'func_vals', None),
+                getattr(line_search, 'gtp', None)]
+
+    def end_call(self, classname, method):
+        """ Marks current call of classname.method as completed
+        """
+        self.calls['%s.%s' % (classname, method)][2] = True
+
+    def callid(self, classname, method):
+        """ Returns ledger id of current call of classname.method
+        """
+        if self.calls and '%s.%s' % (classname, method) in self.calls:
+            return self.calls['%s.%s' % (classname, method)][1]
+
+    def run_task(self, classname, method, kwargs):
+        """ Executes classname.method(**kwargs) as the current task,
+          recording its start and outcome in the ledger
+        """
+        taskid = self.taskid()
+        start = time.time()
+        self.record(classname, method, taskid, event='start')
+
+        status = 1
+        try:
+            func = getattr(sys.modules['seisflows_'+classname], method)
+            func(**kwargs)
+            status = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            raise
+        finally:
+            self.record(classname, method, taskid, event='end',
+                        status=status, runtime=time.time()-start,
+                        cwd=os.getcwd())
+
+    def record(self, classname, method, taskid, **fields):
+        """ Appends record of task to the ledger, PATH.SYSTEM/ledger
+
+          Each record is a line of JSON, written with a single call to
+          write on a file opened in append mode, so that tasks running
+          concurrently do not overwrite one another
+        """
+        fields.update(
+            call=self.callid(classname, method),
+            classname=classname,
+            method=method,
+            task=int(taskid),
+            host=socket.gethostname(),
+            pid=os.getpid(),
+            time=time.time())
+        line = json.dumps(fields, sort_keys=True) + '\n'
+
+        fd = os.open(join(PATH.SYSTEM, 'ledger'),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('ascii'))
+        finally:
+            os.close(fd)
+
+    def outcomes(self, classname, method):
+        """ Returns last 'end' record of each task in the current call of
+          classname.method, keyed by taskid
+        """
+        callid = self.callid(classname, method)
+        filename = join(PATH.SYSTEM, 'ledger')
+        if callid is None or not exists(filename):
+            return {}
+
+        outcomes = {}
+        with open(filename) as f:
+            for line in f:
+                if callid not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # line still being written
+                    continue
+                if record['call'] == callid and record['event'] == 'end':
+                    outcomes[record['task']] = record
+        return outcomes
+
+    def unfinished(self, classname, method, taskids):
+        """ Returns those of the given tasks which have not completed
+          successfully in the current call of classname.method
+        """
+        outcomes = self.outcomes(classname, method)
+        return [taskid for taskid in taskids
+                if outcomes.get(taskid, {}).get('status') != 0]
+
+    def task_error(self, classname, method, taskid):
+        """ Reports failed task, with host and exit status of its last
+          attempt as recorded in the ledger, and stops workflow
+        """
+        print(msg.TaskError_LOCAL % (classname, method, taskid))
+        record = self.outcomes(classname, method).get(taskid)
+        if record:
+            print(' last attempt: host %s, status %s, directory %s\n' %
+                  (record['host'], record['status'], record['cwd']))
+        sys.exit(-1)
+
+    def _launch(self, classname, method, taskid, done, slot=None):
+        """ Starts task in background, returning process and start time
+
+          Once the process exits, taskid, process and exit status are put
+          on queue
+        """
+        env = os.environ.copy()
+        env['SEISFLOWS_TASKID'] = str(taskid)
+        if slot is not None:
+            env['SEISFLOWS_SLOT'] = str(slot)
+
+        # own process group, so that task can be stopped with its children
+        p = Popen(
+            findpath('seisflows.system') + '/' + 'wrappers/run '
+            + PATH.OUTPUT + ' '
+            + classname + ' '
+            + method + ' '
+            + (PAR.ENVIRONS if 'ENVIRONS' in PAR else ''),
+            shell=True,
+            env=env,
+            preexec_fn=os.setsid)
+
+        waiter = Thread(target=lambda: done.put((taskid, p, p.wait())))
+        waiter.daemon = True
+        waiter.start()
+
+        return p, time.time()
+
+    def slot_hostfile(self, hostfile):
+        """ Writes hostfile listing the cores of the slot of the current
+          task, see run_packed, and returns its name
+
+          The file is rewritten on each call, since a resumed workflow may
+          run in a different allocation
+
+          :input hostfile: file listing host of each core of the allocation,
+              one per line, as provided by the scheduler
+        """
+        slot = int(os.environ['SEISFLOWS_SLOT'])
+        filename = join(PATH.SYSTEM, 'hosts', 'slot%04d' % slot)
+
+        with open(hostfile) as f:
+            hosts = f.read().split()
+        hosts = hosts[slot*PAR.NPROC:(slot+1)*PAR.NPROC]
+
+        if not exists(join(PATH.SYSTEM, 'hosts')):
+            unix.mkdir(join(PATH.SYSTEM, 'hosts'))
+
+        # written under a temporary name, since copies of a task may ask for
+        # the same slot's hostfile at once
+        tmpname = '%s.%d' % (filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            f.write('\n'.join(hosts) + '\n')
+        os.rename(tmpname, filename)
+        return filename
+
+    def _kill(self, p):
+        """ Stops process started by _launch, including its children
+        """
+        try:
+            os.killpg(p.pid, signal.SIGTERM)
+        except OSError:
+            pass
@@ -10,6 +10,7 @@ import os
 import sys
 import time
 from os.path import abspath, basename, join
+from subprocess import check_output
 
 # Import utilitaries
 import math
@@ -75,6 +76,31 @@ class lsf_lg(custom_import('system', 'base')):
         if 'NODESIZE' not in PAR:
             raise ParameterError(PAR, 'NODESIZE')
 
+        # run tasks side by side in a single allocation of PAR.NODES nodes,
+        # rather than submitting one job per task
+        if 'PACKED' not in PAR:
+            setattr(PAR, 'PACKED', False)
+
+        if 'NODES' not in PAR:
+            setattr(PAR, 'NODES', int(math.ceil(
+                min(PAR.NTASK, PAR.NTASKMAX)*PAR.NPROC/float(PAR.NODESIZE))))
+
+        # tasks, given as 'classname.method', whose stragglers are relaunched
+        # on idle cores at the end of each call to run, in packed mode
+        # none by default, see base.run_queue
+        if 'SPECULATE' not in PAR:
+            setattr(PAR, 'SPECULATE', [])
+
+        # number of attempts at each task before stopping workflow, in
+        # packed mode
+        if 'MAXTRIES' not in PAR:
+            setattr(PAR, 'MAXTRIES', 1)
+
+        # skip tasks which completed before the workflow was interrupted,
+        # if the interrupted call is repeated after resuming
+        if 'RESUME_TASKS' not in PAR:
+            setattr(PAR, 'RESUME_TASKS', False)
+
         # how to invoke executables
         if 'MPIEXEC' not in PAR:
             setattr(PAR, 'MPIEXEC', 'mpiexec')
@@ -129,7 +155,7 @@ class lsf_lg(custom_import('system', 'base')):
                 + '%s ' % PAR.LSFARGS
                 + '-J %s ' % PAR.TITLE
                 + '-o %s ' % (PATH.WORKDIR+'/'+'output.log')
-                + '-n %d ' % PAR.NODESIZE
+                + '-n %d ' % (PAR.NODESIZE*(PAR.NODES if PAR.PACKED else 1))
                 + '-e %s ' % (PATH.WORKDIR+'/'+'error.log')
                 + '-R "span[ptile=%d]" ' % PAR.NODESIZE
                 + '-W %d:00 ' % PAR.WALLTIME
@@ -142,25 +168,35 @@ class lsf_lg(custom_import('system', 'base')):
           Executes classname.method(\*args, \*\*kwargs) NTASK times, each time on
           NPROC cpu cores
         """
-        self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
+        if PAR.PACKED:
+            return self.run_packed(
+                classname, method, range(PAR.NTASK), (), kwargs)
+
+        self.checkpoint(PATH.OUTPUT, classname, method, (), kwargs)
+
+        # tasks not yet completed, all of them unless resuming
+        taskids = self.unfinished(classname, method, range(PAR.NTASK))
+        if not taskids:
+            self.end_call(classname, method)
+            return
 
         stdout = check_output(
             'bsub %s ' % PAR.LSFARGS
             + '-n %d ' % PAR.NPROC
             + '-R "span[ptile=%d]" ' % PAR.NODESIZE
             + '-W %d:00 ' % PAR.TASKTIME
-            + '-J "%s' % PAR.TITLE
-            + '[%d-%d] %% %d' % (1, PAR.NTASK, PAR.NTASKMAX)
+            + '-J "%s[%s]%%%d" ' % (PAR.TITLE, self.array_indices(taskids),
+                                    PAR.NTASKMAX)
             + '-o %s ' % (PATH.WORKDIR+'/'+'output.lsf/'+'%J_%I')
-            + '%s ' % findpath('seisflows.system') + '/' + 'wrapper/run '
-            + '%s ' % PATH.OUTPUT + ' '
-            + '%s ' % classname + ' '
-            + '%s ' % method + ' '
+            + '%s ' % (findpath('seisflows.system') + '/' + 'wrappers/run')
+            + '%s ' % PATH.OUTPUT
+            + '%s ' % classname
+            + '%s ' % method
             + '%s ' % PAR.ENVIRONS,
             shell=True)
 
         # keep track of job ids
-        jobs = self.job_id_list(stdout, PAR.NTASK)
+        jobs = self.job_id_list(stdout, taskids)
 
         while True:
             # wait 30 seconds before checking status again
@@ -169,6 +205,7 @@ class lsf_lg(custom_import('system', 'base')):
             self.timestamp()
             isdone, jobs = self.job_status(classname, method, jobs)
             if isdone:
+                self.end_call(classname, method)
                 return
 
     def run_single(self, classname, method, hosts='all', **kwargs):
@@ -177,6 +214,9 @@ class lsf_lg(custom_import('system', 'base')):
           Executes classname.method(\*args, \*\*kwargs) NTASK times, each time on
           NPROC cpu cores
         """
+        if PAR.PACKED:
+            return self.run_packed(classname, method, [0], (), kwargs)
+
         self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
 
         stdout = check_output(
@@ -195,7 +235,7 @@ class lsf_lg(custom_import('system', 'base')):
             shell=True)
 
         # keep track of job ids
-        jobs = self.job_id_list(stdout, ntask=1)
+        jobs = self.job_id_list(stdout, [0])
 
         while True:
             # wait 30 seconds before checking status again
@@ -206,13 +246,17 @@ class lsf_lg(custom_import('system', 'base')):
             if isdone:
                 return
 
-    def job_id_list(self, stdout):
+    def array_indices(self, taskids):
+        """ Formats taskids as bsub job array index list, which starts at 1
+        """
+        taskids = list(taskids)
+        if taskids == list(range(taskids[0], taskids[-1]+1)):
+            return '%d-%d' % (taskids[0]+1, taskids[-1]+1)
+        return ','.join(str(taskid+1) for taskid in taskids)
+
+    def job_id_list(self, stdout, taskids):
         job = stdout.split()[1].strip()[1:-1]
-        if ntask == 1:
-            return [job]
-        else:
-            nn = range(1, PAR.NSRC+1)
-            return [job+'['+str(ii)+']' for ii in nn]
+        return [job+'['+str(taskid+1)+']' for taskid in taskids]
 
     def job_status(self, classname, method, jobs):
         # query lsf database
@@ -234,6 +278,10 @@ class lsf_lg(custom_import('system', 'base')):
     def mpiexec(self):
         """ Specifies MPI executable used to invoke solver
         """
+        if PAR.PACKED:
+            # solver is confined to the cores of the task's slot
+            return '%s -n %d -hostfile %s ' % (PAR.MPIEXEC, PAR.NPROC,
+                self.slot_hostfile(os.environ['LSB_DJOB_HOSTFILE']))
         return PAR.MPIEXEC
 
     def _query(self, jobid):
@@ -249,6 +297,9 @@ class lsf_lg(custom_import('system', 'base')):
     def taskid(self):
         """ Provides a unique identifier for each running task
         """
+        if os.getenv('SEISFLOWS_TASKID'):
+            # set for tasks run side by side in packed mode
+            return int(os.getenv('SEISFLOWS_TASKID'))
         return int(os.getenv('LSB_JOBINDEX'))-1
 
     def timestamp(self):
@@ -8,15 +8,16 @@
 # Import system modules
 import os
 import sys
+import traceback
+from multiprocessing import Pool
 from os.path import abspath, basename, join
-from subprocess import Popen
-from time import sleep
+from time import time
 
 # Numpy
 import numpy as np
 
 # Local imports
-from seisflows.tools import unix
+from seisflows.tools import msg, unix
 from seisflows.tools.tools import call, findpath, nproc, saveobj
 from seisflows.config import ParameterError, custom_import
 
@@ -60,6 +61,29 @@ class multicore(custom_import('system', 'serial')):
         if 'NTASKMAX' not in PAR:
             setattr(PAR, 'NTASKMAX', PAR.NPROCMAX/PAR.NPROC)
 
+        # run tasks in worker processes forked from the workflow, rather than
+        # in subprocesses which reload the workflow from disk
+        if 'FORK' not in PAR:
+            setattr(PAR, 'FORK', False)
+
+        # tasks, given as 'classname.method', whose stragglers are relaunched
+        # on idle cores at the end of each call to run
+        # none by default, see base.run_queue
+        if 'SPECULATE' not in PAR:
+            setattr(PAR, 'SPECULATE', [])
+
+        # number of attempts at each task before stopping workflow
+        if 'MAXTRIES' not in PAR:
+            setattr(PAR, 'MAXTRIES', 1)
+
+        # maximum number of concurrent tasks in each stage of a pipeline
+        # after the first, e.g. preprocessing following simulations; tasks
+        # of all stages together are limited to NTASKMAX, so that cores are
+        # not oversubscribed. Pipelines overlap stages only here; cluster
+        # systems, including packed mode, run stages one after another
+        if 'PIPELINE_NTASKMAX' not in PAR:
+            setattr(PAR, 'PIPELINE_NTASKMAX', PAR.NTASKMAX)
+
         # Assertions
         assert PAR.NPROC <= PAR.NPROCMAX
 
@@ -83,30 +107,30 @@ class multicore(custom_import('system', 'serial')):
           Executes classname.method(\*args, \*\*kwargs) NTASK times, each time on
           NPROC cpu cores
         """
-        self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
+        if PAR.FORK:
+            return self._run_forked(classname, method, kwargs)
 
-        running_tasks = dict()
-        queued_tasks = range(PAR.NTASK)
+        self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
 
         # implements "work queue" pattern
-        while queued_tasks or running_tasks:
+        self.run_queue(classname, method, range(PAR.NTASK), PAR.NTASKMAX)
 
-            # launch queued tasks
-            while len(queued_tasks) > 0 and \
-                  len(running_tasks) < PAR.NTASKMAX:
-                i = queued_tasks.pop(0)
-                p = self._run_task(classname, method, taskid=i)
-                running_tasks[i] = p
-                sleep(0.5)
+        print('')
 
-            # checks status of running tasks
-            for i, p in running_tasks.items():
-                if p.poll() is not None:
-                    running_tasks.pop(i)
+    def run_pipeline(self, stages):
+        """ Runs stages, each given as (classname, method, kwargs), for all
+          tasks, overlapping stages of different tasks
 
-            if running_tasks:
-                sleep(1.)
+          Cores used by a task are released as soon as it completes a stage,
+          so that e.g. the next simulation can start while the previous
+          source is preprocessed. At most PAR.NTASKMAX tasks of all stages
+          run at a time
+        """
+        if PAR.FORK:
+            return super(multicore, self).run_pipeline(stages)
 
+        nslots = [PAR.NTASKMAX] + [PAR.PIPELINE_NTASKMAX]*(len(stages)-1)
+        self.run_stages(stages, nslots, PAR.NTASKMAX)
         print('')
 
     def run_single(self, classname, method, *args, **kwargs):
@@ -119,23 +143,65 @@ class multicore(custom_import('system', 'serial')):
 
     # Private methods
 
-    def _run_task(self, classname, method, taskid=0):
-        env = os.environ.copy().items()
-        env += [['SEISFLOWS_TASKID', str(taskid)]]
-        self.progress(taskid)
-
-        p = Popen(
-            findpath('seisflows.system') + '/' + 'wrappers/run '
-            + PATH.OUTPUT + ' '
-            + classname + ' '
-            + method,
-            shell=True,
-            env=dict(env))
+    def _run_forked(self, classname, method, kwargs):
+        """ Runs tasks in a pool of worker processes forked from the current
+          process, which already holds the workflow state
 
-        return p
+          Tasks are dispatched by taskid, and each completion is received as
+          soon as it occurs, without polling
+        """
+        global _task
+        _task = (classname, method, kwargs)
+        self.checkpoint(PATH.OUTPUT, classname, method, (), kwargs)
+
+        # longest tasks are dispatched first
+        taskids = self.dispatch_order(classname, method,
+            self.unfinished(classname, method, range(PAR.NTASK)))
+        runtimes = {}
+
+        pool = Pool(min(PAR.NTASKMAX, PAR.NTASK))
+        try:
+            for taskid, error, runtime in pool.imap_unordered(
+                    _run_forked_task, taskids):
+                runtimes[taskid] = runtime
+                if error:
+                    pool.terminate()
+                    print(msg.TaskError_MULTICORE %
+                          (classname, method, taskid, error))
+                    sys.exit(-1)
+        finally:
+            pool.close()
+            pool.join()
+            _task = None
+
+        self.save_runtimes(classname, method, runtimes)
+        self.end_call(classname, method)
+        print('')
 
     def save_kwargs(self, classname, method, kwargs):
         kwargspath = join(PATH.OUTPUT, 'kwargs')
         kwargsfile = join(kwargspath, classname+'_'+method+'.p')
         unix.mkdir(kwargspath)
         saveobj(kwargsfile, kwargs)
+
+
+# task executed by forked workers, set by multicore._run_forked
+_task = None
+
+
+def _run_forked_task(taskid):
+    """ Executes current task within forked worker, returning taskid,
+      traceback of any error, including SystemExit, and runtime
+    """
+    classname, method, kwargs = _task
+    os.environ['SEISFLOWS_TASKID'] = str(taskid)
+    system = sys.modules['seisflows_system']
+    system.progress(taskid)
+    start = time()
+    try:
+        system.run_task(classname, method, kwargs)
+    except (Exception, SystemExit):
+        return taskid, traceback.format_exc(), time() - start
+    finally:
+        sys.stdout.flush()
+    return taskid, None, time() - start
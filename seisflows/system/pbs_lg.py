@@ -66,10 +66,39 @@ class pbs_lg(custom_import('system', 'base')):
         if 'NPROC' not in PAR:
             raise ParameterError(PAR, 'NPROC')
 
+        # limit on number of concurrent tasks, in packed mode
+        if 'NTASKMAX' not in PAR:
+            setattr(PAR, 'NTASKMAX', PAR.NTASK)
+
         # number of cores per node
         if 'NODESIZE' not in PAR:
             raise ParameterError(PAR, 'NODESIZE')
 
+        # run tasks side by side in a single allocation of PAR.NODES nodes,
+        # rather than submitting one job per task
+        if 'PACKED' not in PAR:
+            setattr(PAR, 'PACKED', False)
+
+        if 'NODES' not in PAR:
+            setattr(PAR, 'NODES', int(math.ceil(
+                min(PAR.NTASK, PAR.NTASKMAX)*PAR.NPROC/float(PAR.NODESIZE))))
+
+        # tasks, given as 'classname.method', whose stragglers are relaunched
+        # on idle cores at the end of each call to run, in packed mode
+        # none by default, see base.run_queue
+        if 'SPECULATE' not in PAR:
+            setattr(PAR, 'SPECULATE', [])
+
+        # number of attempts at each task before stopping workflow, in
+        # packed mode
+        if 'MAXTRIES' not in PAR:
+            setattr(PAR, 'MAXTRIES', 1)
+
+        # skip tasks which completed before the workflow was interrupted,
+        # if the interrupted call is repeated after resuming
+        if 'RESUME_TASKS' not in PAR:
+            setattr(PAR, 'RESUME_TASKS', False)
+
         # how to invoke executables
         if 'MPIEXEC' not in PAR:
             setattr(PAR, 'MPIEXEC', 'mpiexec')
@@ -123,13 +152,14 @@ class pbs_lg(custom_import('system', 'base')):
         minutes = PAR.WALLTIME % 60
         walltime = 'walltime=%02d:%02d:00 ' % (hours, minutes)
 
+        nodes = PAR.NODES if PAR.PACKED else 1
         ncpus = PAR.NODESIZE
         mpiprocs = PAR.NODESIZE
 
         # prepare qsub arguments
         call('qsub '
              + '%s ' % PAR.PBSARGS
-             + '-l select=1:ncpus=%d:mpiprocs=%d ' % (ncpus, mpiprocs)
+             + '-l select=%d:ncpus=%d:mpiprocs=%d ' % (nodes, ncpus, mpiprocs)
              + '-l %s ' % walltime
              + '-N %s ' % PAR.TITLE
              + '-j %s ' % 'oe'
@@ -145,25 +175,44 @@ class pbs_lg(custom_import('system', 'base')):
           Executes classname.method(\*args, \*\*kwargs) NTASK times, each time on
           NPROC cpu cores
         """
-        self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
+        if PAR.PACKED:
+            return self.run_packed(
+                classname, method, range(PAR.NTASK), (), kwargs)
+
+        self.checkpoint(PATH.OUTPUT, classname, method, (), kwargs)
+
+        # tasks not yet completed, all of them unless resuming
+        taskids = self.unfinished(classname, method,
+            range(PAR.NTASK) if hosts == 'all' else [0])
+        if not taskids:
+            self.end_call(classname, method)
+            return
 
-        jobs = self.submit_job_array(classname, method, hosts)
+        jobs = self.submit_job_array(classname, method, hosts, taskids)
         while True:
             # wait a few seconds before checking again
             time.sleep(5)
             self._timestamp()
             isdone, jobs = self.job_array_status(classname, method, jobs)
             if isdone:
+                self.end_call(classname, method)
                 return
 
     def mpiexec(self):
         """ Specifies MPI executable used to invoke solver
         """
+        if PAR.PACKED:
+            # solver is confined to the cores of the task's slot
+            return '%s -n %d -hostfile %s ' % (PAR.MPIEXEC, PAR.NPROC,
+                self.slot_hostfile(os.environ['PBS_NODEFILE']))
         return PAR.MPIEXEC
 
     def taskid(self):
         """ Provides a unique identifier for each running task
         """
+        if os.getenv('SEISFLOWS_TASKID'):
+            # set for tasks run side by side in packed mode
+            return int(os.getenv('SEISFLOWS_TASKID'))
         try:
             return os.getenv('PBS_ARRAY_INDEX')
         except:
@@ -172,23 +221,40 @@ class pbs_lg(custom_import('system', 'base')):
 
     # Private methods
 
-    def submit_job_array(self, classname, method, hosts='all'):
-        with open(PATH.SYSTEM+'/'+'job_id', 'w') as f:
-            call(self.job_array_cmd(classname, method, hosts),
-                 stdout=f)
+    def submit_job_array(self, classname, method, hosts, taskids):
+        """ Submits job array for each contiguous range of taskids, since
+          PBS array indices are given as ranges, and returns job ids
+        """
+        jobs = []
+        for first, last in self.array_ranges(taskids):
+            with open(PATH.SYSTEM+'/'+'job_id', 'w') as f:
+                call(self.job_array_cmd(classname, method, hosts, first, last),
+                     stdout=f)
+
+            # retrieve job ids
+            with open(PATH.SYSTEM+'/'+'job_id', 'r') as f:
+                line = f.readline()
+                job = line.split()[-1].strip()
+            if hosts == 'all' and PAR.NTASK > 1:
+                job0 = job.strip('[].sdb')
+                jobs += [job0+'['+str(ii)+'].sdb'
+                         for ii in range(first, last+1)]
+            else:
+                jobs += [job]
+        return jobs
 
-        # retrieve job ids
-        with open(PATH.SYSTEM+'/'+'job_id', 'r') as f:
-            line = f.readline()
-            job = line.split()[-1].strip()
-        if hosts == 'all' and PAR.NTASK > 1:
-            nn = range(PAR.NTASK)
-            job0 = job.strip('[].sdb')
-            return [job0+'['+str(ii)+'].sdb' for ii in nn]
-        else:
-            return [job]
-
-    def job_array_cmd(self, classname, method, hosts):
+    def array_ranges(self, taskids):
+        """ Splits taskids into contiguous ranges, given as (first, last)
+        """
+        ranges = []
+        for taskid in sorted(taskids):
+            if ranges and taskid == ranges[-1][1]+1:
+                ranges[-1][1] = taskid
+            else:
+                ranges += [[taskid, taskid]]
+        return [tuple(r) for r in ranges]
+
+    def job_array_cmd(self, classname, method, hosts, first=0, last=0):
         nodes = math.ceil(PAR.NTASK/float(PAR.NODESIZE))
         ncpus = PAR.NPROC
         mpiprocs = PAR.NPROC
@@ -199,24 +265,23 @@ class pbs_lg(custom_import('system', 'base')):
 
         return ('qsub '
                 + '%s ' % PAR.PBSARGS
-                + '-l select=%d:ncpus=%d:mpiprocs=%d ' (nodes, ncpus, mpiprocs)
+                + '-l select=%d:ncpus=%d:mpiprocs=%d '
+                    % (nodes, ncpus, mpiprocs)
                 + '-l %s ' % walltime
-                + '-J 0-%s ' % (PAR.NTASK-1)
                 + '-N %s ' % PAR.TITLE
-                + '-o %s ' % (PATH.WORKDIR+'/'+'output.pbs/' + '$PBS_ARRAYID')
                 + '-r y '
                 + '-j oe '
                 + '-V '
-                + self.job_array_args(hosts)
+                + self.job_array_args(hosts, first, last)
                 + PATH.OUTPUT + ' '
                 + classname + ' '
                 + method + ' '
-                + 'PYTHONPATH=' + findpath('seisflows.system'), +','
+                + 'PYTHONPATH=' + findpath('seisflows.system') + ','
                 + PAR.ENVIRONS)
 
-    def job_array_args(self, hosts):
+    def job_array_args(self, hosts, first=0, last=0):
         if hosts == 'all':
-            args = ('-J 0-%s ' % (PAR.NTASK-1)
+            args = ('-J %d-%d ' % (first, last)
                     + '-o %s ' % (PATH.WORKDIR + '/' + 'output.pbs/' +
                                   '$PBS_ARRAYID')
                     + ' -- '
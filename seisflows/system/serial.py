@@ -79,6 +79,11 @@ class serial(custom_import('system', 'base')):
         if 'LOCAL' not in PATH:
             setattr(PATH, 'LOCAL', None)
 
+        # skip tasks which completed before the workflow was interrupted,
+        # if the interrupted call is repeated after resuming
+        if 'RESUME_TASKS' not in PAR:
+            setattr(PAR, 'RESUME_TASKS', False)
+
     def submit(self, workflow):
         """ Submits job
         """
@@ -98,14 +103,15 @@ class serial(custom_import('system', 'base')):
             taskid is used to identified a given task (one source)
         """
         unix.mkdir(PATH.SYSTEM)
+        self.checkpoint(PATH.OUTPUT, classname, method, (), kwargs)
 
-        for taskid in range(PAR.NTASK):
+        for taskid in self.unfinished(classname, method, range(PAR.NTASK)):
             # set environment variable SEISFLOWS_TASKID to taskid :
             os.environ['SEISFLOWS_TASKID'] = str(taskid)
             if PAR.VERBOSE > 0:
                 self.progress(taskid)
-            func = getattr(__import__('seisflows_'+classname), method)
-            func(**kwargs)
+            self.run_task(classname, method, kwargs)
+        self.end_call(classname, method)
         print('')
 
     def run_single(self, classname, method, *args, **kwargs):
@@ -126,11 +132,3 @@ class serial(custom_import('system', 'base')):
         """ Specifies MPI executable used to invoke solver
         """
         return PAR.MPIEXEC
-
-    def progress(self, taskid):
-        """ Provides status update
-        """
-        if PAR.NTASK > 1:
-            print(' task ' + '%02d of %02d' % (taskid+1, PAR.NTASK))
-        else:
-            print(' task running')
\ No newline at end of file
@@ -77,6 +77,31 @@ class slurm_lg(custom_import('system', 'base')):
         if 'NODESIZE' not in PAR:
             raise ParameterError(PAR, 'NODESIZE')
 
+        # run tasks side by side in a single allocation of PAR.NODES nodes,
+        # rather than submitting one job per task
+        if 'PACKED' not in PAR:
+            setattr(PAR, 'PACKED', False)
+
+        if 'NODES' not in PAR:
+            setattr(PAR, 'NODES', int(math.ceil(
+                min(PAR.NTASK, PAR.NTASKMAX)*PAR.NPROC/float(PAR.NODESIZE))))
+
+        # tasks, given as 'classname.method', whose stragglers are relaunched
+        # on idle cores at the end of each call to run, in packed mode
+        # none by default, see base.run_queue
+        if 'SPECULATE' not in PAR:
+            setattr(PAR, 'SPECULATE', [])
+
+        # number of attempts at each task before stopping workflow, in
+        # packed mode
+        if 'MAXTRIES' not in PAR:
+            setattr(PAR, 'MAXTRIES', 1)
+
+        # skip tasks which completed before the workflow was interrupted,
+        # if the interrupted call is repeated after resuming
+        if 'RESUME_TASKS' not in PAR:
+            setattr(PAR, 'RESUME_TASKS', False)
+
         # optional additional SLURM arguments
         if 'SLURMARGS' not in PAR:
             setattr(PAR, 'SLURMARGS', '')
@@ -85,6 +110,22 @@ class slurm_lg(custom_import('system', 'base')):
         if 'ENVIRONS' not in PAR:
             setattr(PAR, 'ENVIRONS', '')
 
+        # commands used to submit jobs and query their states, which can be
+        # replaced by local stand-in scripts for testing
+        if 'SBATCH' not in PAR:
+            setattr(PAR, 'SBATCH', 'sbatch')
+
+        if 'SACCT' not in PAR:
+            setattr(PAR, 'SACCT', 'sacct')
+
+        # bounds on interval between job status queries in seconds; interval
+        # grows for as long as job states do not change
+        if 'POLLMIN' not in PAR:
+            setattr(PAR, 'POLLMIN', 5.)
+
+        if 'POLLMAX' not in PAR:
+            setattr(PAR, 'POLLMAX', 60.)
+
         # level of detail in output messages
         if 'VERBOSE' not in PAR:
             setattr(PAR, 'VERBOSE', 1)
@@ -123,12 +164,12 @@ class slurm_lg(custom_import('system', 'base')):
         workflow.checkpoint()
 
         # prepare sbatch arguments
-        call('sbatch '
+        call('%s ' % PAR.SBATCH
              + '%s ' % PAR.SLURMARGS
              + '--job-name=%s ' % PAR.TITLE
              + '--output %s ' % (PATH.WORKDIR+'/'+'output.log')
              + '--ntasks-per-node=%d ' % PAR.NODESIZE
-             + '--nodes=%d ' % 1
+             + '--nodes=%d ' % (PAR.NODES if PAR.PACKED else 1)
              + '--time=%d ' % PAR.WALLTIME
              + findpath('seisflows.system') + '/' + 'wrappers/submit '
              + PATH.OUTPUT)
@@ -139,17 +180,29 @@ class slurm_lg(custom_import('system', 'base')):
           Executes classname.method(\*args, \*\*kwargs) NTASK times, each time on
           NPROC cpu cores
         """
+        if PAR.PACKED:
+            return self.run_packed(
+                classname, method, range(PAR.NTASK), args, kwargs)
+
         self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
 
+        # tasks not yet completed, all of them unless resuming
+        taskids = self.unfinished(classname, method, range(PAR.NTASK))
+        if not taskids:
+            self.end_call(classname, method)
+            return
+
         # submit job array
         stdout = check_output(
-                   'sbatch %s ' % PAR.SLURMARGS
+                   '%s ' % PAR.SBATCH
+                   + '%s ' % PAR.SLURMARGS
                    + '--job-name=%s ' % PAR.TITLE
                    + '--nodes=%d ' % math.ceil(PAR.NPROC/float(PAR.NODESIZE))
                    + '--ntasks-per-node=%d ' % PAR.NODESIZE
                    + '--ntasks=%d ' % PAR.NPROC
                    + '--time=%d ' % PAR.TASKTIME
-                   + '--array=%d-%d ' % (0, (PAR.NTASK-1) % PAR.NTASKMAX)
+                   + '--array=%s%%%d ' % (self.array_indices(taskids),
+                                            PAR.NTASKMAX)
                    + '--output %s ' % (PATH.WORKDIR + '/' + 'output.slurm/' +
                                        '%A_%a')
                    + '%s ' % (findpath('seisflows.system') + '/' +
@@ -162,15 +215,10 @@ class slurm_lg(custom_import('system', 'base')):
 
         # keep track of job ids
         jobs = self.job_id_list(stdout, PAR.NTASK)
+        jobs = [jobs[taskid] for taskid in taskids]
 
         # check job array completion status
-        while True:
-            # wait a few seconds between queries
-            time.sleep(5)
-
-            isdone, jobs = self.job_array_status(classname, method, jobs)
-            if isdone:
-                return
+        self.wait(classname, method, jobs)
 
     def run_single(self, classname, method, *args, **kwargs):
         """ Runs task a single time
@@ -178,11 +226,15 @@ class slurm_lg(custom_import('system', 'base')):
           Executes classname.method(\*args, \*\*kwargs) a single time on NPROC
           cpu cores
         """
+        if PAR.PACKED:
+            return self.run_packed(classname, method, [0], args, kwargs)
+
         self.checkpoint(PATH.OUTPUT, classname, method, args, kwargs)
 
         # submit job
         stdout = check_output(
-                   'sbatch %s ' % PAR.SLURMARGS
+                   '%s ' % PAR.SBATCH
+                   + '%s ' % PAR.SLURMARGS
                    + '--job-name=%s ' % PAR.TITLE
                    + '--nodes=%d ' % math.ceil(PAR.NPROC/float(PAR.NODESIZE))
                    + '--ntasks-per-node=%d ' % PAR.NODESIZE
@@ -204,17 +256,14 @@ class slurm_lg(custom_import('system', 'base')):
         jobs = self.job_id_list(stdout, 1)
 
         # check job completion status
-        while True:
-            # wait a few seconds between queries
-            time.sleep(5)
-
-            isdone, jobs = self.job_array_status(classname, method, jobs)
-            if isdone:
-                return
+        self.wait(classname, method, jobs)
 
     def mpiexec(self):
         """ Specifies MPI executable used to invoke solver
         """
+        if PAR.PACKED:
+            # job steps share allocation without overlapping
+            return 'srun --exclusive --ntasks=%d ' % PAR.NPROC
         return 'srun '
 
     def taskid(self):
@@ -227,24 +276,61 @@ class slurm_lg(custom_import('system', 'base')):
 
     # Job array methods
 
-    def job_array_status(self, classname, method, jobs):
+    def wait(self, classname, method, jobs):
+        """ Waits for completion of job or job array
+
+          States of all jobs are queried at once. The interval between
+          queries doubles, up to PAR.POLLMAX, while states do not change, and
+          is reset to PAR.POLLMIN whenever they do.
+        """
+        interval = PAR.POLLMIN
+        states = None
+
+        while True:
+            time.sleep(interval)
+
+            last, states = states, self.job_states(jobs)
+            isdone, jobs = self.job_array_status(
+                classname, method, jobs, states)
+            if isdone:
+                self.end_call(classname, method)
+                return
+
+            if states == last:
+                interval = min(2*interval, PAR.POLLMAX)
+            else:
+                interval = PAR.POLLMIN
+
+    def job_array_status(self, classname, method, jobs, states=None):
         """ Determines completion status of job or job array
+
+          If states are not given, they are queried with a single command.
+          Outcomes recorded by tasks in the ledger take precedence, since
+          they are available as soon as tasks end, whereas job accounting
+          may lag behind.
         """
-        states = []
+        if states is None:
+            states = self.job_states(jobs)
+        outcomes = self.outcomes(classname, method)
+
         for job in jobs:
-            state = self.job_status(job)
-            if state in ['TIMEOUT']:
+            state = states.get(job, '')
+            status = outcomes.get(self.array_index(job), {}).get('status')
+            if status == 0:
+                continue
+            elif status is not None:
+                print(msg.TaskError_SLURM % (classname, method, job))
+                sys.exit(-1)
+            elif state in ['TIMEOUT']:
                 print(msg.TimoutError % (classname, method, job, PAR.TASKTIME))
                 sys.exit(-1)
             elif state in ['FAILED', 'NODE_FAIL']:
                 print(msg.TaskError_SLURM % (classname, method, job))
                 sys.exit(-1)
-            elif state in ['COMPLETED']:
-                states += [1]
-            else:
-                states += [0]
 
-        isdone = all(states)
+        isdone = all(states.get(job) == 'COMPLETED' or
+                     outcomes.get(self.array_index(job), {}).get('status') == 0
+                     for job in jobs)
 
         return isdone, jobs
 
@@ -254,16 +340,38 @@ class slurm_lg(custom_import('system', 'base')):
         job_id = stdout.split()[-1].strip()
         return [job_id+'_'+str(ii) for ii in range(ntask)]
 
+    def array_index(self, job):
+        """ Returns array index, i.e. taskid, of job array element
+        """
+        return int(job.split('_')[-1])
+
+    def array_indices(self, taskids):
+        """ Formats taskids as sbatch --array index list
+        """
+        taskids = list(taskids)
+        if taskids == list(range(taskids[0], taskids[-1]+1)):
+            return '%d-%d' % (taskids[0], taskids[-1])
+        return ','.join(str(taskid) for taskid in taskids)
+
     def job_status(self, job):
         """ Queries completion status of a single job
         """
+        return self.job_states([job]).get(job, '')
+
+    def job_states(self, jobs):
+        """ Queries states of all given jobs with a single command
+
+          Returns dictionary mapping job ids to states; jobs not yet known
+          to the scheduler, e.g. pending array elements, are left out
+        """
+        arrays = sorted(set(job.split('_')[0] for job in jobs))
         stdout = check_output(
-            'sacct -n -o jobid,state -j ' + job.split('_')[0],
+            '%s -n -o jobid%%32,state -j %s' % (PAR.SACCT, ','.join(arrays)),
             shell=True)
 
-        state = ''
-        lines = stdout.strip().split('\n')
-        for line in lines:
-            if line.split()[0] == job:
-                state = line.split()[1]
-        return state
+        states = {}
+        for line in stdout.strip().split('\n'):
+            fields = line.split()
+            if len(fields) >= 2:
+                states[fields[0]] = fields[1]
+        return states
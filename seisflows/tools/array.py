@@ -20,6 +20,7 @@ import scipy.interpolate as _interp
 
 # Local imports
 from seisflows.tools.math import gauss2
+from seisflows.tools.tools import loadjson, savejson
 
 
 def count_zeros(a):
@@ -79,8 +80,10 @@ def stack(*args):
 
 # Array input/output
 
-def loadnpy(filename):
+def loadnpy(filename, mmap=False):
     """Loads numpy binary file."""
+    if mmap:
+        return np.load(filename, mmap_mode='r')
     return np.load(filename)
 
 
@@ -90,6 +93,114 @@ def savenpy(filename, v):
     os.rename(filename + '.npy', filename)
 
 
+class VectorStore(object):
+    """ Holds named vectors of equal length in a single memory mapped file
+
+      Each vector occupies one row of an (nrow, n) array stored in binary
+      file 'path'. A small JSON index 'path.json' records shape, data type
+      and which row belongs to which name, so that renaming or removing a
+      vector only modifies the index. The file is opened at most once per
+      process, and the memory map itself is never pickled.
+    """
+    def __init__(self, path, nrow=8):
+        self.path = path
+        self.nrow = nrow
+        self._data = None
+        self._index = None
+
+    def __contains__(self, name):
+        return name in self.index['rows']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        state['_index'] = None
+        return state
+
+    def load(self, name, mmap=False):
+        """ Returns copy of given vector, or if mmap is True, a view into
+          the file that remains valid until the vector is overwritten
+        """
+        row = self.index['rows'][name]
+        if mmap:
+            return self.data[row]
+        return np.array(self.data[row])
+
+    def save(self, name, v):
+        """ Writes vector, reusing its row if name is already present
+        """
+        v = np.squeeze(v)
+        if not self.index['rows']:
+            # (re)initialize file based on the first vector written
+            self._create(len(v), v.dtype)
+
+        rows = self.index['rows']
+        if name in rows:
+            row = rows[name]
+        else:
+            row = self._free_row()
+        self.data[row] = v
+        self.data.flush()
+
+        rows[name] = row
+        self._write_index()
+
+    def rename(self, src, dst):
+        """ Renames vector, discarding any existing vector called dst
+        """
+        rows = self.index['rows']
+        rows[dst] = rows.pop(src)
+        self._write_index()
+
+    def remove(self, name):
+        """ Discards vector, if present
+        """
+        if self.index['rows'].pop(name, None) is not None:
+            self._write_index()
+
+    @property
+    def index(self):
+        if self._index is None:
+            if os.path.exists(self.path+'.json'):
+                self._index = loadjson(self.path+'.json')
+            else:
+                self._index = {'rows': {}, 'shape': [0, 0], 'dtype': ''}
+        return self._index
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.memmap(self.path, mode='r+',
+                                   dtype=self.index['dtype'],
+                                   shape=tuple(self.index['shape']))
+        return self._data
+
+    def _create(self, n, dtype):
+        self._data = np.memmap(self.path, mode='w+', dtype=dtype,
+                               shape=(self.nrow, n))
+        self.index['shape'] = [self.nrow, n]
+        self.index['dtype'] = np.dtype(dtype).str
+
+    def _free_row(self):
+        nrow, n = self.index['shape']
+        used = set(self.index['rows'].values())
+        for row in range(nrow):
+            if row not in used:
+                return row
+
+        # grow file in place and remap
+        self.data.flush()
+        self._data = None
+        itemsize = np.dtype(self.index['dtype']).itemsize
+        with open(self.path, 'r+b') as file:
+            file.truncate(2*nrow*n*itemsize)
+        self.index['shape'] = [2*nrow, n]
+        return nrow
+
+    def _write_index(self):
+        savejson(self.path+'.json', self.index)
+
+
 # In the function and variable names, we use 'grid' to describe a set of
 # structured coordinates, and 'mesh' to describe a set of unstructured
 # coordinates
@@ -175,6 +175,33 @@ TASK ERROR
 """
 
 
+TaskError_LOCAL = """
+
+TASK ERROR
+
+    Task failed:  %s.%s
+
+    Task %d exited with nonzero status
+
+    Stopping workflow...
+
+"""
+
+
+TaskError_MULTICORE = """
+
+TASK ERROR
+
+    Task failed:  %s.%s
+
+    Task %d raised:
+
+%s
+    Stopping workflow...
+
+"""
+
+
 ###
 
 obspyImportError = """
@@ -5,8 +5,13 @@
 #
 ###############################################################################
 
-# Import Numpy
+# Import system modules
+import warnings
+
+# Import Numpy and Scipy
 import numpy as np
+import scipy.signal as _signal
+from scipy.fftpack import next_fast_len
 
 
 # Functions acting on whole record sections
@@ -26,6 +31,106 @@ def sconvolve(s, h, w, inplace=True):
         return s2
 
 
+def sdetrend(s):
+    """ Removes mean and linear trend from each trace of record section,
+      equivalent to obspy detrend('demean') followed by detrend('linear')
+    """
+    s = _signal.detrend(s, axis=-1, type='constant')
+    return _signal.detrend(s, axis=-1, type='linear')
+
+
+def staper(s, max_percentage=0.05):
+    """ Applies Hann taper to both ends of each trace of record section,
+      equivalent to obspy taper(max_percentage, type='hann')
+    """
+    nt = s.shape[-1]
+    wlen = min(int(max_percentage*nt), int(nt/2))
+    if 2*wlen == nt:
+        sides = _signal.hann(2*wlen)
+    else:
+        sides = _signal.hann(2*wlen+1)
+    taper = np.hstack((sides[:wlen], np.ones(nt-2*wlen),
+                       sides[len(sides)-wlen:]))
+    return s*taper
+
+
+def sbandpass(s, freqmin, freqmax, df, corners=4):
+    """ Applies zero-phase Butterworth bandpass filter to each trace of
+      record section, equivalent to obspy filter('bandpass', zerophase=True)
+    """
+    fe = 0.5*df
+    low = freqmin/fe
+    high = freqmax/fe
+    if high - 1.0 > -1e-6:
+        warnings.warn('Selected high corner frequency of bandpass is at or '
+                      'above Nyquist. Applying a high-pass instead.')
+        return shighpass(s, freqmin, df, corners)
+    if low > 1:
+        raise ValueError('Selected low corner frequency is above Nyquist.')
+    return _sosfilt_zerophase(s, corners, [low, high], 'band')
+
+
+def slowpass(s, freq, df, corners=4):
+    """ Applies zero-phase Butterworth lowpass filter to each trace of
+      record section, equivalent to obspy filter('lowpass', zerophase=True)
+    """
+    f = freq/(0.5*df)
+    if f > 1:
+        f = 1.0
+        warnings.warn('Selected corner frequency is above Nyquist. '
+                      'Setting Nyquist as high corner.')
+    return _sosfilt_zerophase(s, corners, f, 'lowpass')
+
+
+def shighpass(s, freq, df, corners=4):
+    """ Applies zero-phase Butterworth highpass filter to each trace of
+      record section, equivalent to obspy filter('highpass', zerophase=True)
+    """
+    f = freq/(0.5*df)
+    if f > 1:
+        raise ValueError('Selected corner frequency is above Nyquist.')
+    return _sosfilt_zerophase(s, corners, f, 'highpass')
+
+
+def _sosfilt_zerophase(s, corners, wn, btype):
+    # filters forwards and then backwards along time axis, as obspy does
+    z, p, k = _signal.iirfilter(corners, wn, btype=btype, ftype='butter',
+                                output='zpk')
+    sos = _signal.zpk2sos(z, p, k)
+    s = _signal.sosfilt(sos, s, axis=-1)
+    return _signal.sosfilt(sos, s[..., ::-1], axis=-1)[..., ::-1]
+
+
+def offsets(s_coords, r_coords):
+    """ Returns source-receiver distances
+    """
+    sx, sy = np.asarray(s_coords[0], float), np.asarray(s_coords[1], float)
+    rx, ry = np.asarray(r_coords[0], float), np.asarray(r_coords[1], float)
+    return np.sqrt((rx-sx)**2 + (ry-sy)**2)
+
+
+def csg_tapers(picks, nt, T, T1):
+    """ Constructs common shot gather tapers for all traces at once
+
+      Returns array of shape (nr, nt), each row being a window of width T1
+      centered on the corresponding pick, with Gaussian flanks of width T
+    """
+    j = np.arange(nt)[np.newaxis, :]
+    tau_o = np.asarray(picks)[:, np.newaxis]
+    b1 = tau_o - 0.5 * T1
+    b2 = tau_o + 0.5 * T1
+
+    # conditions are evaluated in the same order as in the original loop
+    return np.select([
+        j < b1 - 10 * T,
+        (j >= b1 - 20 * T) & (j <= b1),
+        (j >= b1) & (j <= b2)], [
+        0.,
+        np.exp(-(j-tau_o)**2/2*(2*T)**2),
+        1.],
+        np.exp(-(j-b2)**2/2*(2*T)**2))
+
+
 def mute_early_arrivals(traces, slope, const, time_scheme, s_coords, r_coords):
     """ Applies tapered mask to record section, muting early arrivals
 
@@ -140,7 +245,7 @@ def mask(slope, const, offset, time_scheme, length=400):
     win = win[0:length]
 
     # caculate offsets
-    itmin = int(np.ceil((slope*abs(offset)+const)/dt)) - length/2
+    itmin = int(np.ceil((slope*abs(offset)+const)/dt)) - length//2
     itmax = itmin + length
 
     if 1 < itmin < itmax < nt:
@@ -157,11 +262,99 @@ def mask(slope, const, offset, time_scheme, length=400):
     return mask
 
 
+def masks(slope, const, offsets, time_scheme, length=400):
+    """ Constructs tapered masks for all traces of record section at once
+
+      Returns array of shape (nr, nt) whose rows are identical to those
+      returned by mask for the given offsets.
+    """
+    nt, _, _ = time_scheme
+    itmin = mask_onsets(slope, const, offsets, time_scheme, length)
+    return onset_masks(itmin, nt, length)
+
+
+def mask_onsets(slope, const, offsets, time_scheme, length=400):
+    """ Returns index of first sample of the taper of each mask
+      constructed by masks, which is all that depends on the offsets
+    """
+    _, dt, _ = time_scheme
+
+    # caculate offsets
+    offsets = np.abs(np.asarray(offsets, dtype=float))
+    return np.ceil((slope*offsets+const)/dt).astype(int) - length//2
+
+
+def onset_masks(itmin, nt, length=400):
+    """ Expands taper onsets returned by mask_onsets into array of masks
+      of shape (nr, nt)
+    """
+    # construct taper
+    win = np.sin(np.linspace(0, np.pi, 2*length))
+    win = win[0:length]
+
+    itmin = np.asarray(itmin)
+    itmax = itmin + length
+
+    # position of each sample relative to start of taper
+    k = np.arange(nt)[np.newaxis, :] - itmin[:, np.newaxis]
+    w = np.where(k < 0, 0., win[np.clip(k, 0, length-1)])
+    w[k >= length] = 1.
+
+    # cases left untouched by mask
+    tapered = ((1 < itmin) & (itmax < nt)) | \
+              ((itmin < 1) & (1 <= itmax)) | \
+              ((itmin < nt) & (nt < itmax)) | \
+              (itmin > nt)
+    w[~tapered] = 1.
+
+    return w
+
+
 def correlate(u, v):
     w = np.convolve(u, np.flipud(v))
     return w
 
 
+def correlation_lag(u, v, dt, subsample=True):
+    """ Returns time lag of u relative to v at which the absolute value of
+      their cross-correlation peaks, i.e. the lag determined from
+      correlate(u, v). Computed via FFT along the last axis, so that record
+      sections of shape (nr, nt) are processed all at once.
+
+      If subsample is True, the peak is refined by fitting a parabola
+      through the three samples around it.
+    """
+    nt = np.shape(u)[-1]
+    nfft = next_fast_len(2*nt-1)
+
+    cc = np.fft.irfft(np.fft.rfft(u, nfft) * np.conj(np.fft.rfft(v, nfft)),
+                      nfft)
+
+    # reorder lags from -(nt-1) to nt-1, as in np.convolve output
+    cc = abs(np.concatenate((cc[..., nfft-nt+1:], cc[..., :nt]), axis=-1))
+
+    it = np.argmax(cc, axis=-1)
+    lag = (it-nt+1).astype(float)
+
+    if subsample:
+        inner = (it > 0) & (it < 2*nt-2)
+        c0 = _take(cc, it)
+        cm = _take(cc, np.where(inner, it-1, it))
+        cp = _take(cc, np.where(inner, it+1, it))
+        denom = cm - 2.*c0 + cp
+        ok = inner & (denom < 0.)
+        lag += np.where(ok, 0.5*(cm-cp)/np.where(ok, denom, 1.), 0.)
+
+    return lag*dt
+
+
+def _take(a, i):
+    # selects one entry along last axis for each row
+    i = np.asarray(i)
+    return a.reshape(-1, a.shape[-1])[np.arange(i.size), i.ravel()]\
+        .reshape(i.shape)
+
+
 def tukeywin(nt, imin, imax, alpha=0.05):
     t = np.linspace(0, 1, imax-imin)
     w = np.zeros(imax-imin)
@@ -16,6 +16,8 @@ import time
 import traceback
 from imp import load_source
 from importlib import import_module
+from multiprocessing import current_process
+from multiprocessing.pool import Pool, ThreadPool
 from pkgutil import find_loader
 from os.path import basename, exists
 from subprocess import check_output
@@ -90,6 +92,50 @@ def iterable(arg):
         return arg
 
 
+# function mapped by process pools, inherited by forked workers
+_pmap_func = None
+
+
+def _pmap_call(item):
+    return _pmap_func(item)
+
+
+def pmap(func, items, nthreads=1, processes=False):
+    """ Maps function over items using a pool of threads
+
+      Intended for I/O bound work, such as reading or writing many files.
+      If processes is True, a pool of forked processes is used instead, which
+      suits CPU bound work; func need not be picklable, but its results must
+      be. Results are returned in the same order as items.
+
+      Daemonic processes, such as the workers of system.multicore with
+      PAR.FORK, cannot have children, so these fall back to threads.
+    """
+    global _pmap_func
+
+    items = list(items)
+    if nthreads <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    if processes and not current_process().daemon:
+        # workers inherit func when forked
+        _pmap_func = func
+        pool = Pool(min(nthreads, len(items)))
+        try:
+            return pool.map(_pmap_call, items)
+        finally:
+            pool.close()
+            pool.join()
+            _pmap_func = None
+
+    pool = ThreadPool(min(nthreads, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def module_exists(name):
     return find_loader(name)
 
@@ -149,8 +195,10 @@ def loadpy(filename):
     return output
 
 
-def loadnpy(filename):
+def loadnpy(filename, mmap=False):
     """Loads numpy binary file."""
+    if mmap:
+        return np.load(filename, mmap_mode='r')
     return np.load(filename)
 
 
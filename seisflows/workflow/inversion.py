@@ -7,7 +7,6 @@
 
 # Import system modules
 import sys
-from glob import glob
 from os.path import join
 
 # Import Numpy
@@ -106,6 +105,11 @@ class inversion(base):
         if 'SAVERESIDUALS' not in PAR:
             setattr(PAR, 'SAVERESIDUALS', 0)
 
+        # preprocess data as a separate stage, which systems with local task
+        # queues overlap with simulations of other sources
+        if 'PIPELINE' not in PAR:
+            setattr(PAR, 'PIPELINE', False)
+
         # parameter assertions
         assert 1 <= PAR.BEGIN <= PAR.END
 
@@ -172,8 +176,7 @@ class inversion(base):
         self.write_model(path=PATH.GRAD, suffix='new')
 
         print('Generating synthetics')
-        system.run('solver', 'eval_func',
-                   path=PATH.GRAD)
+        self.run_eval_func(path=PATH.GRAD)
 
         self.write_misfit(path=PATH.GRAD, suffix='new')
 
@@ -219,11 +222,23 @@ class inversion(base):
         """
         self.write_model(path=PATH.FUNC, suffix='try')
 
-        system.run('solver', 'eval_func',
-                   path=PATH.FUNC)
+        self.run_eval_func(path=PATH.FUNC)
 
         self.write_misfit(path=PATH.FUNC, suffix='try')
 
+    def run_eval_func(self, path):
+        """ Carries out forward simulations and writes residuals, for all
+          sources
+        """
+        if PAR.PIPELINE:
+            system.run_pipeline([
+                ('solver', 'eval_func', {'path': path,
+                                         'write_residuals': False}),
+                ('solver', 'eval_residuals', {'path': path})])
+        else:
+            system.run('solver', 'eval_func',
+                       path=path)
+
     def evaluate_gradient(self):
         """ Performs adjoint simulation to evaluate gradient
         """
@@ -250,7 +265,8 @@ class inversion(base):
         if divides(optimize.iter, PAR.SAVETRACES):
             self.save_traces()
 
-        if divides(optimize.iter, PAR.SAVERESIDUALS):
+        if divides(optimize.iter, PAR.SAVERESIDUALS) and \
+                PAR.EXPORT_RESIDUALS:
             self.save_residuals()
 
     def clean(self):
@@ -282,21 +298,24 @@ class inversion(base):
         src = join(path, 'gradient')
         dst = 'g_'+suffix
         postprocess.write_gradient(path)
-        parts = solver.load(src, suffix='_kernel')
+        gradient = solver.load_merged(src, suffix='_kernel')
         # At some point in specfem development the gradient became - gradient
         if PAR.MINUSGRADIENT:
-            optimize.save(dst, -solver.merge(parts))
+            optimize.save(dst, -gradient)
         else:
-            optimize.save(dst, solver.merge(parts))
+            optimize.save(dst, gradient)
 
     def write_misfit(self, path='', suffix=''):
         """ Writes misfit in format expected by nonlinear optimization library
         """
-        src = glob(path + '/' + 'residuals/*')
+        src = path + '/' + 'misfit'
         dst = 'f_'+suffix
-        total_misfit = preprocess.sum_residuals(src)
+        total_misfit = preprocess.sum_misfit(src)
         optimize.savetxt(dst, total_misfit)
 
+        # next evaluation starts a new record
+        unix.rm(src)
+
     def save_gradient(self):
         src = join(PATH.GRAD, 'gradient')
         dst = join(PATH.OUTPUT, 'gradient_%04d' % optimize.iter)
@@ -14,7 +14,6 @@ import numpy as np
 
 # Local imports
 from seisflows.tools import unix
-from seisflows.tools.array import loadnpy, savenpy
 from seisflows.tools.tools import savetxt
 from seisflows.config import ParameterError
 from seisflows.workflow.base import base
@@ -101,7 +100,7 @@ class test_optimize(base):
 
         unix.cd(cls.path)
         m = problem.model_init()
-        savenpy('m_new', m)
+        optimize.save('m_new', m)
 
     def compute_direction(cls):
         cls.evaluate_gradient()
@@ -114,9 +113,9 @@ class test_optimize(base):
         optimize.initialize_newton()
 
         for ilcg in range(PAR.LCGMAX):
-            m = loadnpy('m_lcg')
+            m = optimize.load('m_lcg')
             g = problem.grad(m)
-            savenpy('g_lcg', g)
+            optimize.save('g_lcg', g)
             isdone = optimize.iterate_newton()
             if isdone:
                 break
@@ -146,20 +145,20 @@ class test_optimize(base):
                     sys.exit(-1)
 
     def evaluate_function(cls):
-        m = loadnpy('m_try')
+        m = optimize.load('m_try')
         f = problem.func(m)
         savetxt('f_try', f)
 
     def evaluate_gradient(cls):
-        m = loadnpy('m_new')
+        m = optimize.load('m_new')
         f = problem.func(m)
         g = problem.grad(m)
         savetxt('f_new', f)
-        savenpy('g_new', g)
+        optimize.save('g_new', g)
 
     def finalize(cls):
-        m_new = loadnpy('m_new')
-        m_old = loadnpy('m_old')
+        m_new = optimize.load('m_new')
+        m_old = optimize.load('m_old')
 
         if PAR.VERBOSE > 0:
             print('%14.7e %14.7e' % tuple(m_new))
@@ -0,0 +1,61 @@
+
+import unittest
+
+import pickle
+import shutil
+from os.path import join
+from tempfile import mkdtemp
+
+import numpy as np
+
+from seisflows.tools.array import VectorStore
+
+
+class TestToolsArray(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.path = join(self.tmpdir, 'vectors')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_vectorstore_saveload(self):
+        store = VectorStore(self.path, nrow=2)
+        vectors = dict(('v%d' % i, np.random.rand(10).astype('float32'))
+                       for i in range(5))
+
+        # more vectors than rows, so that file grows
+        for name, v in vectors.items():
+            store.save(name, v)
+
+        # reopen from disk, as another process would
+        store = VectorStore(self.path)
+        for name, v in vectors.items():
+            self.assertTrue(np.array_equal(store.load(name), v))
+
+    def test_vectorstore_rename_remove(self):
+        store = VectorStore(self.path)
+        u = np.arange(10, dtype='float32')
+        v = -u
+        store.save('m_new', u)
+        store.save('m_old', v)
+
+        # renaming onto existing name discards it
+        store.rename('m_new', 'm_old')
+        self.assertFalse('m_new' in store)
+        self.assertTrue(np.array_equal(store.load('m_old'), u))
+
+        # row freed by rename and remove is reused
+        store.remove('m_old')
+        store.remove('m_old')
+        self.assertFalse('m_old' in store)
+        store.save('g_new', v)
+
+        store = pickle.loads(pickle.dumps(store))
+        self.assertEqual(sorted(store.index['rows']), ['g_new'])
+        self.assertTrue(np.array_equal(store.load('g_new'), v))
+        self.assertEqual(store.index['shape'][0], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+
+import unittest
+
+import sys
+
+import numpy as np
+
+from seisflows.tools.tools import Struct
+
+PAR = sys.modules['seisflows_parameters'] = Struct()
+PATH = sys.modules['seisflows_paths'] = Struct()
+sys.modules['seisflows_system'] = Struct()
+
+from seisflows.preprocess.double_difference import double_difference
+
+
+def brute_force_pairs(preprocess, rx, ry):
+    # distance between (x_i, y_i) and (x_j, y_j) of every pair i > j
+    pairs = []
+    for i in range(len(rx)):
+        for j in range(i):
+            dist = preprocess.distance(rx[i], ry[i], rx[j], ry[j])
+            if dist <= PAR.DISTMAX:
+                pairs += [(i, j, dist)]
+    return pairs
+
+
+class TestPreprocessDoubleDifference(unittest.TestCase):
+    def check_pairs(self, rx, ry):
+        preprocess = double_difference()
+        i, j, dist = preprocess.pairs(rx, ry)
+        ref = brute_force_pairs(preprocess, rx, ry)
+
+        self.assertEqual(list(zip(i, j)), [(a, b) for a, b, _ in ref])
+        self.assertTrue(np.allclose(dist, [d for _, _, d in ref]))
+
+    def test_pairs(self):
+        PAR.UNITS = 'xy'
+        PAR.DISTMAX = 1.
+
+        # stations (10, 0) and (11, 0) are 1 apart; reading coordinates as
+        # (x_i, x_j, y_i, y_j), as was done before, would put them 14.9 apart
+        i, j, dist = double_difference().pairs([10., 11., 13.], [0., 0., 0.])
+        self.assertEqual(list(i), [1])
+        self.assertEqual(list(j), [0])
+        self.assertTrue(np.allclose(dist, [1.]))
+
+        rng = np.random.RandomState(0)
+        self.check_pairs(rng.rand(200)*10., rng.rand(200)*10.)
+
+    def test_pairs_lonlat(self):
+        PAR.UNITS = 'lonlat'
+        PAR.DISTMAX = 5.
+
+        rng = np.random.RandomState(0)
+        self.check_pairs(rng.rand(200)*40. - 20., rng.rand(200)*40. - 20.)
+
+
+if __name__ == '__main__':
+    unittest.main()
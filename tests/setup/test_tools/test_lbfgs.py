@@ -0,0 +1,80 @@
+
+import unittest
+
+import os
+import shutil
+from os.path import join
+from tempfile import mkdtemp
+
+import numpy as np
+
+from seisflows.plugins.optimize.LBFGS import LBFGS
+from seisflows.tools.tools import loadnpy, savenpy
+
+
+def two_loop(q, S, Y):
+    # textbook L-BFGS recursion, most recent pair first
+    rh = [1./np.dot(y, s) for s, y in zip(S, Y)]
+    al = []
+    for s, y, r in zip(S, Y, rh):
+        al += [r*np.dot(s, q)]
+        q = q - al[-1]*y
+    q = q*np.dot(Y[0], S[0])/np.dot(Y[0], Y[0])
+    for s, y, r, a in reversed(list(zip(S, Y, rh, al))):
+        q = q + s*(a - r*np.dot(y, q))
+    return q
+
+
+class TestOptimizeLBFGS(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def check_directions(self, **kwargs):
+        # convex quadratic, so that all directions are descent directions
+        n, memory = 50, 3
+        rng = np.random.RandomState(0)
+        A = rng.randn(n, n)
+        A = np.dot(A, A.T) + n*np.eye(n)
+        m = rng.randn(n).astype('float32')
+
+        path = join(self.tmpdir, str(len(os.listdir(self.tmpdir))))
+        os.mkdir(path)
+        lbfgs = LBFGS(path, loadnpy, savenpy, memory=memory, **kwargs)
+        S, Y = [], []
+
+        for it in range(8):
+            g = np.dot(A, m).astype('float32')
+            savenpy(join(path, 'm_new'), m)
+            savenpy(join(path, 'g_new'), g)
+
+            p, status = lbfgs()
+            self.assertEqual(status, 0)
+            if it > 0:
+                S = [m - loadnpy(join(path, 'm_old'))] + S[:memory-1]
+                Y = [g - loadnpy(join(path, 'g_old'))] + Y[:memory-1]
+                ref = -two_loop(g.astype(float), S, Y)
+            else:
+                ref = -g
+            self.assertTrue(np.allclose(p, ref, rtol=1.e-3, atol=1.e-6))
+
+            os.rename(join(path, 'm_new'), join(path, 'm_old'))
+            os.rename(join(path, 'g_new'), join(path, 'g_old'))
+            m = m + 0.01*np.asarray(p, dtype='float32')
+
+    def test_direction(self):
+        self.check_directions()
+
+    def test_direction_blocked(self):
+        self.check_directions(blocksize=7)
+
+    def test_direction_outofcore(self):
+        self.check_directions(outofcore=True, blocksize=7)
+
+
+if __name__ == '__main__':
+    unittest.main()
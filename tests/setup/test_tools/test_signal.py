@@ -6,6 +6,23 @@ import numpy as np
 from seisflows.tools import signal
 
 
+def csg_taper(nt, tau_o, T, T1):
+    # taper of a single trace, built sample by sample
+    tapering = np.zeros(nt)
+    b1 = tau_o - 0.5 * T1
+    b2 = tau_o + 0.5 * T1
+    for j in range(nt):
+        if j < b1 - 10 * T:
+            tapering[j] = 0
+        elif j >= b1 - 20 * T and j <= b1:
+            tapering[j] = np.exp(-(j-tau_o)**2/2*(2*T)**2)
+        elif j >= b1 and j <= b2:
+            tapering[j] = 1
+        else:
+            tapering[j] = np.exp(-(j-b2)**2/2*(2*T)**2)
+    return tapering
+
+
 class TestSeistoolsSignal(unittest.TestCase):
     def setUp(self):
         pass
@@ -31,6 +48,77 @@ class TestSeistoolsSignal(unittest.TestCase):
         # check monotonicity
         assert(np.all(np.diff(w) >= 0))
 
+    def test_masks(self):
+        # time scheme
+        nt = 100
+        dt = 1.e-3
+
+        # mute parameters, chosen so that tapers fall before, across
+        # and after the time window
+        slope = 1.e-3
+        const = 0.
+        offsets = np.array([-30., 0., 10., 45., 90., 200.])
+
+        w = signal.masks(slope, const, offsets, (nt, dt, 0.), length=10)
+
+        for ir, offset in enumerate(offsets):
+            assert np.array_equal(w[ir],
+                signal.mask(slope, const, offset, (nt, dt, 0.), length=10))
+
+    def test_sbandpass(self):
+        from obspy import Trace
+
+        nr, nt, dt = 3, 500, 1.e-2
+        s = np.random.randn(nr, nt).astype('float32')
+
+        # filter record section all at once
+        s1 = signal.sbandpass(signal.staper(signal.sdetrend(s)),
+                              1., 10., 1./dt)
+
+        # filter trace by trace using obspy
+        for ir in range(nr):
+            tr = Trace(data=s[ir].copy())
+            tr.stats.delta = dt
+            tr.detrend('demean')
+            tr.detrend('linear')
+            tr.taper(0.05, type='hann')
+            tr.filter('bandpass', zerophase=True, freqmin=1., freqmax=10.)
+            assert(np.allclose(s1[ir], tr.data, atol=1.e-5))
+
+    def test_correlation_lag(self):
+        nt, dt = 301, 1.e-2
+        t = np.arange(nt)*dt
+        u = np.exp(-((t-1.537)/0.1)**2)
+        v = np.exp(-((t-1.2)/0.1)**2)
+
+        # integer lag agrees with direct correlation
+        cc = abs(signal.correlate(u, v))
+        lag = signal.correlation_lag(u, v, dt, subsample=False)
+        assert(np.isclose(lag, (np.argmax(cc)-nt+1)*dt))
+
+        # subsample lag is closer to true shift; rows are independent
+        lag = signal.correlation_lag(np.vstack((u, v)), np.vstack((v, u)), dt)
+        assert(np.allclose(lag, [0.337, -0.337], atol=1.e-3))
+
+    def test_csg_tapers(self):
+        nt = 200
+        picks = [50, 120]
+
+        w = signal.csg_tapers(picks, nt, 1., 40)
+
+        # tapers pass window around each pick and vanish far before it
+        assert(np.all(w[0, 31:71] == 1.) and np.all(w[1, 101:141] == 1.))
+        assert(np.all(w[1, :90] == 0.))
+        assert(np.all((w >= 0.) & (w <= 1.)))
+
+        # agrees with taper built trace by trace
+        rng = np.random.RandomState(0)
+        picks = rng.randint(0, nt, 20)
+        for T, T1 in [(0.01, 40), (0.1, 25), (1., 41)]:
+            w = signal.csg_tapers(picks, nt, T, T1)
+            for ir, pick in enumerate(picks):
+                assert(np.allclose(w[ir], csg_taper(nt, pick, T, T1)))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+
+import unittest
+
+import shutil
+from os.path import join
+from tempfile import mkdtemp
+
+import numpy as np
+
+
+def make_stream(nr, nt, dt):
+    # record section with distinct source and receiver coordinates
+    from obspy import Stream, Trace
+    from obspy.core.util import AttribDict
+    from obspy.io.segy.segy import SEGYTraceHeader
+
+    stream = Stream()
+    for ir in range(nr):
+        trace = Trace(data=np.random.randn(nt).astype('float32'))
+        trace.stats.delta = dt
+        header = SEGYTraceHeader()
+        header.source_coordinate_x = 100
+        header.source_coordinate_y = -50
+        header.group_coordinate_x = 10*ir
+        header.group_coordinate_y = 20*ir + 5
+        header.scalar_to_be_applied_to_all_coordinates = -1
+        trace.stats.segy = AttribDict(trace_header=header)
+        stream.append(trace)
+    return stream
+
+
+class TestPluginsSu(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+        # writers use a dummy sample count of 9999, which obspy can read
+        self.nr, self.nt, self.dt = 4, 9999, 1.e-3
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read(self):
+        import obspy
+        from seisflows.plugins.readers import SuSection, readBigSuFile
+
+        filename = join(self.tmpdir, 'U_file_single.su')
+        make_stream(self.nr, self.nt, self.dt).write(
+            filename, format='SU', byteorder='<')
+        ref = obspy.read(filename, format='SU', byteorder='<')
+
+        section = SuSection(filename, self.nt)
+        self.assertEqual(len(section), self.nr)
+        self.assertAlmostEqual(section.delta, ref[0].stats.delta)
+        self.assertTrue(np.array_equal(section.data,
+                                       [tr.data for tr in ref]))
+
+        rx, ry, _ = section.receiver_coords()
+        sx, sy, _ = section.source_coords()
+        for ir, tr in enumerate(ref):
+            header = tr.stats.su.trace_header
+            self.assertEqual(rx[ir], header.group_coordinate_x)
+            self.assertEqual(ry[ir], header.group_coordinate_y)
+            self.assertEqual(sx[ir], header.source_coordinate_x)
+            self.assertEqual(sy[ir], header.source_coordinate_y)
+
+        stream = readBigSuFile(filename, self.nt)
+        for tr, tr_ref in zip(stream, ref):
+            self.assertTrue(np.array_equal(tr.data, tr_ref.data))
+            self.assertEqual(tr.stats.delta, tr_ref.stats.delta)
+
+    def test_write(self):
+        import obspy
+        from seisflows.plugins.readers import SuSection
+        from seisflows.plugins.writers import writeBigSuFile, writeSuSection
+
+        syn = join(self.tmpdir, 'syn.su')
+        make_stream(self.nr, self.nt, self.dt).write(
+            syn, format='SU', byteorder='<')
+        data = np.random.randn(self.nr, self.nt).astype('float32')
+
+        # write data with headers of synthetics, trace by trace and at once
+        stream = obspy.read(syn, format='SU', byteorder='<')
+        for tr, d in zip(stream, data):
+            tr.data = d
+        writeBigSuFile(stream, join(self.tmpdir, 'ref.su'))
+        writeSuSection(data, SuSection(syn, self.nt).headers,
+                       join(self.tmpdir, 'adj.su'))
+
+        with open(join(self.tmpdir, 'ref.su'), 'rb') as f:
+            ref = f.read()
+        with open(join(self.tmpdir, 'adj.su'), 'rb') as f:
+            self.assertEqual(f.read(), ref)
+
+        # round trip through obspy reader
+        stream = obspy.read(join(self.tmpdir, 'adj.su'), format='SU',
+                            byteorder='<')
+        self.assertTrue(np.array_equal([tr.data for tr in stream], data))
+        self.assertAlmostEqual(stream[0].stats.delta, self.dt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+
+import unittest
+
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+from os.path import exists, join
+from subprocess import Popen
+from tempfile import mkdtemp
+from threading import Thread
+
+from seisflows.tools.tools import Struct, loadobj
+
+PAR = sys.modules['seisflows_parameters'] = Struct()
+PATH = sys.modules['seisflows_paths'] = Struct()
+
+from seisflows.system.base import base
+from seisflows.system.multicore import multicore
+from seisflows.system.serial import serial
+
+
+class StubSystem(base):
+    """ Runs shell commands in place of tasks, recording launches
+    """
+    def __init__(self, command):
+        self.command = command
+        self.launches = []
+        self.processes = []
+        self.methods = []
+        self.busy = set()
+        self.running = []
+        self.maxrunning = 0
+
+    def _launch(self, classname, method, taskid, done, slot=None):
+        if slot is not None:
+            assert slot not in self.busy
+            self.busy.add(slot)
+
+        attempt = len([i for i, _ in self.launches if i == taskid])
+        self.launches += [(taskid, slot)]
+        self.methods += [method]
+
+        p = Popen(self.command(taskid, attempt), shell=True,
+                  preexec_fn=os.setsid)
+        self.processes += [p]
+        self.running += [p]
+        self.maxrunning = max(self.maxrunning, len(self.running))
+
+        def wait():
+            status = p.wait()
+            self.busy.discard(slot)
+            self.running.remove(p)
+            done.put((taskid, p, status))
+
+        waiter = Thread(target=wait)
+        waiter.daemon = True
+        waiter.start()
+        return p, time.time()
+
+    def run(self, classname, method, taskids, nslots):
+        self.begin_call(classname, method, {})
+        self.run_queue(classname, method, taskids, nslots)
+
+
+def short_task(taskid, attempt):
+    return 'sleep 0.05'
+
+
+class StubTask(object):
+    """ Records completed tasks, failing task 2 on its first attempt
+    """
+    def run(self, path):
+        taskid = int(os.environ['SEISFLOWS_TASKID'])
+        if taskid == 2 and not exists(join(path, 'failed')):
+            open(join(path, 'failed'), 'w').close()
+            sys.exit(1)
+        with open(join(path, 'completed'), 'a') as f:
+            f.write('%d\n' % taskid)
+
+
+class TestSystemQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        PATH.SYSTEM = self.tmpdir
+        PAR.NTASK = 6
+        PAR.SPECULATE = []
+        PAR.MAXTRIES = 1
+        PAR.RESUME_TASKS = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dispatch_order(self):
+        system = base()
+        system.save_runtimes('solver', 'eval_func', {0: 1., 1: 3., 2: 2.})
+        system.save_runtimes('solver', 'eval_func', {0: 4.})
+
+        self.assertEqual(
+            system.dispatch_order('solver', 'eval_func', range(4)),
+            [3, 0, 1, 2])
+
+    def test_run_queue(self):
+        system = StubSystem(lambda taskid, attempt: 'sleep 0.05')
+        system.run('solver', 'eval_func', range(PAR.NTASK), 2)
+
+        # each task runs once, on one of two slots
+        self.assertEqual(sorted(i for i, _ in system.launches),
+                         list(range(PAR.NTASK)))
+        self.assertEqual(set(slot for _, slot in system.launches), set([0, 1]))
+        self.assertEqual(
+            sorted(system.load_runtimes('solver', 'eval_func')),
+            sorted(str(i) for i in range(PAR.NTASK)))
+
+    def test_speculate(self):
+        # first copy of last task straggles
+        def command(taskid, attempt):
+            if taskid == 5 and attempt == 0:
+                return 'sleep 10'
+            return 'sleep 0.05'
+
+        PAR.SPECULATE = ['task.run']
+        sys.modules['seisflows_task'] = Struct(speculative=['run'])
+        system = StubSystem(command)
+        start = time.time()
+        try:
+            system.run('task', 'run', range(PAR.NTASK), 3)
+        finally:
+            del sys.modules['seisflows_task']
+
+        self.assertLess(time.time() - start, 5.)
+        self.assertEqual(len([i for i, _ in system.launches if i == 5]), 2)
+
+        # stopped copy has exited
+        self.assertTrue(all(p.poll() is not None for p in system.processes))
+
+    def test_speculate_side_effects(self):
+        from seisflows.tools.err import ParameterError
+
+        PAR.SPECULATE = ['solver.eval_func']
+        sys.modules['seisflows_solver'] = Struct()
+        system = StubSystem(lambda taskid, attempt: 'true')
+        with self.assertRaises(ParameterError):
+            system.run('solver', 'eval_func', range(PAR.NTASK), 2)
+        self.assertEqual(system.launches, [])
+
+    def test_failure(self):
+        system = StubSystem(
+            lambda taskid, attempt: 'exit %d' % (taskid == 2))
+        with self.assertRaises(SystemExit):
+            system.run('solver', 'eval_func', range(PAR.NTASK), 2)
+
+    def test_retry(self):
+        # task 2 fails on its first attempt only
+        PAR.MAXTRIES = 2
+        system = StubSystem(
+            lambda taskid, attempt: 'exit %d' % (taskid == 2 and not attempt))
+        system.run('solver', 'eval_func', range(PAR.NTASK), 2)
+
+        self.assertEqual(sorted(i for i, _ in system.launches),
+                         [0, 1, 2, 2, 3, 4, 5])
+
+    def test_pipeline(self):
+        PATH.OUTPUT = self.tmpdir
+        for name in ['preprocess', 'solver', 'postprocess', 'optimize',
+                     'workflow']:
+            sys.modules['seisflows_'+name] = Struct()
+
+        system = StubSystem(short_task)
+        sys.modules['seisflows_system'] = system
+        system.run_stages([('solver', 'eval_func', {}),
+                           ('solver', 'eval_residuals', {})], [3, 3], 3)
+
+        # stages share a single budget of concurrent tasks
+        self.assertEqual(system.methods.count('eval_func'), PAR.NTASK)
+        self.assertEqual(system.methods.count('eval_residuals'), PAR.NTASK)
+        self.assertEqual(system.maxrunning, 3)
+
+
+class TestSystemResume(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        PATH.SYSTEM = join(self.tmpdir, 'system')
+        PATH.OUTPUT = join(self.tmpdir, 'output')
+        PAR.NTASK = 4
+        PAR.NTASKMAX = 2
+        PAR.VERBOSE = 0
+        PAR.FORK = True
+        PAR.RESUME_TASKS = True
+        os.mkdir(PATH.SYSTEM)
+
+        # state saved along with system by checkpoint
+        for name in ['preprocess', 'solver', 'postprocess', 'optimize',
+                     'workflow']:
+            sys.modules['seisflows_'+name] = Struct()
+        sys.modules['seisflows_task'] = StubTask()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        del sys.modules['seisflows_task']
+
+    def completed(self):
+        if not exists(join(self.tmpdir, 'completed')):
+            return Counter()
+        with open(join(self.tmpdir, 'completed')) as f:
+            return Counter(int(line) for line in f)
+
+    def check_resume(self, system):
+        sys.modules['seisflows_system'] = system
+        with self.assertRaises(SystemExit):
+            system.run('task', 'run', path=self.tmpdir)
+        first = self.completed()
+        self.assertFalse(2 in first)
+
+        # resume from state saved on disk, as sfresume would
+        system = loadobj(join(PATH.OUTPUT, 'seisflows_system.p'))
+        sys.modules['seisflows_system'] = system
+        remaining = system.unfinished('task', 'run', range(PAR.NTASK))
+        self.assertEqual(sorted(remaining),
+                         [i for i in range(PAR.NTASK) if i not in first])
+
+        system.run('task', 'run', path=self.tmpdir)
+        self.assertEqual(self.completed(), Counter(range(PAR.NTASK)))
+
+        # completed call is run again in full
+        system.run('task', 'run', path=self.tmpdir)
+        self.assertEqual(self.completed(), Counter(2*list(range(PAR.NTASK))))
+
+    def test_resume_serial(self):
+        self.check_resume(serial())
+
+    def test_resume_forked(self):
+        self.check_resume(multicore())
+
+    def test_resume_model_changed(self):
+        system = serial()
+        sys.modules['seisflows_system'] = system
+        with self.assertRaises(SystemExit):
+            system.run('task', 'run', path=self.tmpdir)
+
+        # interrupted call with same arguments but next model is not resumed
+        sys.modules['seisflows_optimize'].iter = 2
+        system.run('task', 'run', path=self.tmpdir)
+        self.assertEqual(self.completed(), Counter([0, 1, 0, 1, 2, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()